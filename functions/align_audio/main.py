@@ -7,7 +7,10 @@ from tempfile import TemporaryDirectory
 import funcy as F
 
 from quarantine_chorus import align
+from quarantine_chorus import cache
+from quarantine_chorus import config
 from quarantine_chorus import ffmpeg
+from quarantine_chorus import wav
 from quarantine_chorus.decorators import log_return
 from quarantine_chorus.submission import Submission
 
@@ -22,11 +25,40 @@ logging.basicConfig(level=logging.DEBUG)
 # not). I expect each time sample rate is cut in half we might lose a couple samples of
 # accuracy in the final shift, but since we have to round the shift to milliseconds for
 # ffmpeg anyways, it shouldn't make any difference in practice.
+#
+# This is only the starting point: with `memory_budget_mb` in the correlation config,
+# the aligner lowers precision, sample rate, and analysis duration further for long
+# submissions rather than running out of memory (see align.plan_alignment).
 ANALYSIS_SAMPLERATE = 24000
 
 
-def loudnorm_analysis(subj_file, singer_count, cfg):
-    params = cfg if singer_count == 1 else cfg.get('multiple_singers', cfg)
+# Cloud function instances are reused between invocations, and every submission for a
+# song is aligned against the same reference. Keep the most recent Aligner around so
+# that a warm instance doesn't decode and transform the same reference again.
+_aligner_cache = {}
+
+
+def get_aligner(ref_file, corr_kwargs, alignment_cache=None):
+    key = (cache.hash_file(ref_file), cache.hash_params(**corr_kwargs))
+    if key not in _aligner_cache:
+        _aligner_cache.clear()
+        _aligner_cache[key] = align.Aligner(ref_file, cache=alignment_cache,
+                                            **corr_kwargs)
+    else:
+        logging.info("Reusing cached reference for %s", ref_file)
+    return _aligner_cache[key]
+
+
+def loudnorm_analysis(subj_file, singer_count, cfg, extracted=None):
+    """Returns loudnorm analysis for the subject.
+
+    Uses the analysis extract_audio made while decoding the upload (`extracted`), if
+    it was made with the same params, rather than decoding the audio again.
+    """
+    params = ffmpeg.loudnorm_params(cfg, singer_count)
+    if extracted and all(extracted.get(k) == params[k] for k in ('i', 'tp', 'lra')):
+        logging.info("Using loudnorm analysis from audio extraction")
+        return extracted
     logging.info("Running loudnorm analysis for %d singer(s)", singer_count)
     return ffmpeg.run_loudnorm_analysis(subj_file, params)
 
@@ -47,6 +79,10 @@ def main(data, context):
     if submission.filename.startswith('lead'):
         return f"Ignoring lead audio file: gcs://{data['bucket']}{data['name']}"
 
+    # ... or an analysis sidecar
+    if not data['name'].endswith('.' + submission.audio_extension()):
+        return f"Ignoring non-audio file: gcs://{data['bucket']}{data['name']}"
+
     # Check required files
     audio = submission.audio_extracted
     if not audio.exists():
@@ -61,6 +97,7 @@ def main(data, context):
     audio_cfg = submission.song_config()['audio']
     loudnorm_cfg = submission.song_config()['loudnorm']
     corr_cfg = submission.song_config()['correlation']
+    corr_kwargs = {'samplerate': ANALYSIS_SAMPLERATE, **corr_cfg}
 
     with TemporaryDirectory() as tempdir:
         os.chdir(tempdir)
@@ -72,17 +109,27 @@ def main(data, context):
         logging.info("Downloading reference %s", reference.url)
         reference.download(reference.filename)
 
+        # Sidecars (written by extract_audio) save decoding the audio again. They
+        # have to be downloaded after their audio file, or they look out of date.
+        sidecar_suffix = wav.sidecar_suffix(corr_kwargs['samplerate'])
+        for gcs in (audio, reference):
+            sidecar = gcs.with_suffix(sidecar_suffix)
+            if sidecar.exists():
+                logging.info("Downloading analysis sidecar %s", sidecar.url)
+                sidecar.download(gcs.filename + sidecar_suffix)
+
         # Process
-        analysis, _ = align.cross_correlate(
-            reference.filename,
-            audio.filename,
-            samplerate=corr_cfg.get('samplerate', ANALYSIS_SAMPLERATE),
-            preprocess=corr_cfg.get('preprocess')
-        )
+        # Alignment results are cached by content, so retries and config changes
+        # that don't affect alignment return immediately. The cache bucket expires
+        # old entries on its own (see infrastructure/storage.tf).
+        alignment_cache = cache.GCSStore(submission.storage_client(),
+                                         config.CACHE_BUCKET, 'alignment/')
+        aligner = get_aligner(reference.filename, corr_kwargs, alignment_cache)
+        analysis = aligner.align(audio.filename).analysis
         if audio_cfg['loudnorm']:
-            analysis['loudnorm'] = loudnorm_analysis(audio.filename,
-                                                     submission.singer_count(),
-                                                     loudnorm_cfg)
+            analysis['loudnorm'] = loudnorm_analysis(
+                audio.filename, submission.singer_count(), loudnorm_cfg,
+                (submission.get_firestore_data('extracted_audio') or {}).get('loudnorm'))
 
         # Update firestore
         logging.info('Saving analysis data to firestore')
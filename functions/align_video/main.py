@@ -15,38 +15,47 @@ if ffmpeg.EXECUTABLE != 'ffmpeg':
     ffmpeg.EXECUTABLE = os.path.abspath(ffmpeg.EXECUTABLE)
 
 
-def write_aligned_video(in_file, out_file, analysis, cfg):
-    stream = ffmpeg.input(in_file)
-
-    # Video filters
-    if ffmpeg.probe(in_file).video:
-        video = stream.video
-        # Detect crop at 20 seconds into the video
-        crop = ffmpeg.run_cropdetect(in_file, ss=20)
-        if crop:
-            video = video.crop(**crop)
-        if cfg.get('resize'):
-            video = video.scale(**cfg['resize'])
-        video = video.align_video(analysis)
-    else:
-        video = None
-
-    # Audio filters
-    audio = stream.audio
-    audio = audio.align_audio(analysis)
-    if analysis.get('loudnorm'):
-        audio = audio.loudnorm(analysis['loudnorm'], resample=cfg.get('samplerate'))
-    elif cfg.get('samplerate'):
-        audio = audio.resample(cfg.get('samplerate'))
-
-    # Output
-    output_args = {}
-    if cfg.get('framerate'):
-        output_args['r'] = cfg.get('framerate')
-    output_args['movflags'] = '+faststart'  # allow re-encoding on the fly
-    output_args['ac'] = 1
-    streams = [audio, video] if video else [audio]
-    return ffmpeg.output(*streams, out_file, **output_args).run(overwrite_output=True)
+def media_analysis(submission, in_file, version):
+    """Returns `ffmpeg.analyze_media` results for the upload.
+
+    Only the probe and crop are used here, so the audio isn't analyzed: that would
+    decode all of it, while cropdetect only decodes a few keyframes. Results are
+    saved in firestore with the upload's version, so retries (and anything else
+    that needs them) don't analyze the same upload again.
+    """
+    media = submission.get_firestore_data('media_analysis')
+    if media and media.get('version') == version:
+        logging.info("Using saved media analysis")
+        return media
+    media = ffmpeg.analyze_media(in_file, probe=ffmpeg.probe(in_file, version=version),
+                                 audio=False)
+    media['version'] = version
+    logging.info("Saving media analysis to firestore")
+    submission.firestore_document().set({'media_analysis': media}, merge=True)
+    return media
+
+
+def write_aligned_video(in_file, out_file, analysis, cfg, media):
+    probe = ffmpeg.ProbeResult.from_dict(media['probe'])
+    profile = ffmpeg.encode.get_profile(cfg)
+
+    # Copy streams that already match the config, and skip filters that do nothing
+    plan = ffmpeg.plan.plan_encode(probe, analysis, cfg, crop=media.get('crop'),
+                                   profile=profile)
+    logging.info("Encode plan: %s", plan)
+
+    # Long videos can be encoded a segment per cpu
+    segments = cfg.get('segments', 1)
+    if plan.video == ffmpeg.plan.ENCODE and segments != 1:
+        return ffmpeg.segments.encode_segmented(
+            in_file, out_file, analysis, profile, probe.duration,
+            segments=segments or None,
+            video_filter=ffmpeg.plan.video_filter(plan),
+            audio_filter=ffmpeg.plan.audio_filter(plan),
+            framerate=plan.framerate)
+
+    return (ffmpeg.plan.output(in_file, out_file, plan, analysis, profile)
+            .run(overwrite_output=True))
 
 
 @log_return(level=logging.WARNING)
@@ -77,7 +86,8 @@ def main(data, context):
 
         # Output
         out_file = 'tmp_' + video.filename
-        write_aligned_video(video.filename, out_file, analysis, video_cfg)
+        media = media_analysis(submission, video.filename, video.version())
+        write_aligned_video(video.filename, out_file, analysis, video_cfg, media)
 
         # Upload
         logging.info("Uploading to %s", submission.video_aligned.url)
@@ -5,26 +5,48 @@ import os
 from tempfile import TemporaryDirectory
 
 from quarantine_chorus import ffmpeg
+from quarantine_chorus import wav
 from quarantine_chorus.decorators import log_return
 from quarantine_chorus.submission import Submission
 
 logging.basicConfig(level=logging.DEBUG)
 
 
-def extract_audio_to_file(in_file, out_file, cfg):
-    return (
+def extract_audio_to_file(in_file, out_file, cfg, analysis_samplerate,
+                          loudnorm_cfg=None):
+    """Extracts audio from an upload with a single decode.
+
+    The decoded audio is split three ways in one ffmpeg process: the encoded audio
+    file, mono PCM at `analysis_samplerate` (returned as an array, for the analysis
+    sidecar), and, if `loudnorm_cfg` is given, the loudnorm analysis pass.
+
+    Returns (pcm, loudnorm analysis or None).
+    """
+    audio = (
         ffmpeg.input(in_file)
         .audio
         .filter('aresample', cfg.get('samplerate', 48000), first_pts=0)
         .filter('asetpts', 'PTS-STARTPTS')
-        .output(
-            out_file,
-            acodec=cfg.get('codec', 'aac'),
-            audio_bitrate=cfg.get('bitrate', '128k'),
-            ac=1,
-        )
-        .run(overwrite_output=True)
+        # Downmix before splitting, so every output hears the same mono audio
+        .filter('aformat', channel_layouts='mono')
     )
+    split = audio.filter_multi_output('asplit', 3 if loudnorm_cfg else 2)
+    outputs = [split[1].output(
+        out_file,
+        acodec=cfg.get('codec', 'aac'),
+        audio_bitrate=cfg.get('bitrate', '128k'),
+        ac=1,
+    )]
+    if loudnorm_cfg:
+        outputs.append(ffmpeg.loudnorm_analysis_filter(split[2], loudnorm_cfg)
+                       .output('-', f='null'))
+    with wav.Decoder(in_file, analysis_samplerate, audio=split[0],
+                     outputs=outputs) as decoder:
+        pcm = wav.read_all(decoder, ffmpeg.probe(in_file).duration)
+    loudnorm = None
+    if loudnorm_cfg:
+        loudnorm = ffmpeg.parse_loudnorm_analysis(decoder.stderr, loudnorm_cfg)
+    return pcm, loudnorm
 
 
 @log_return(logging.WARNING)
@@ -46,13 +68,32 @@ def main(data, context):
         logging.info("Downloading %s", video.url)
         video.download(video.filename)
 
-        # Extract
+        # Extract. Everything later stages need from the audio comes out of this one
+        # decode, so align_audio never has to decode it again.
         audio_cfg = submission.song_config()['audio']
+        loudnorm_cfg = None
+        if audio_cfg['loudnorm']:
+            loudnorm_cfg = ffmpeg.loudnorm_params(submission.song_config()['loudnorm'],
+                                                  submission.singer_count())
+        samplerate = submission.song_config()['correlation']['samplerate']
         logging.info("Extracting audio to %s", audio.filename)
-        extract_audio_to_file(video.filename, audio.filename, audio_cfg)
+        pcm, loudnorm = extract_audio_to_file(video.filename, audio.filename,
+                                              audio_cfg, samplerate, loudnorm_cfg)
+
+        # Analysis-ready PCM, so align_audio can memory-map it. Written after the
+        # audio file, so that it isn't out of date.
+        sidecar_suffix = wav.sidecar_suffix(samplerate)
+        sidecar_file = wav.write_sidecar(audio.filename, samplerate, pcm)
+
+        # Loudness stats for align_audio, saved before the audio file is uploaded
+        if loudnorm:
+            logging.info("Saving loudnorm analysis to firestore")
+            submission.firestore_document().set(
+                {'extracted_audio': {'loudnorm': loudnorm}}, merge=True)
 
         # Upload reference audio files first (so they're available for align_audio
-        # before the main file is uploaded).
+        # before the main file is uploaded). Sidecars go before their audio file for
+        # the same reason.
         if submission.is_reference():
             logging.info("Reference submission: creating reference files.")
             for reference in submission.audio_reference_candidates():
@@ -60,8 +101,14 @@ def main(data, context):
                 # https://googleapis.dev/python/storage/latest/buckets.html#google.cloud.storage.bucket.Bucket.copy_blob
                 # But it's nice to be able to run this using a LocalSubmission, and
                 # we'd have to reimplement the copy function.
+                sidecar = reference.with_suffix(sidecar_suffix)
+                logging.info("Uploading to %s", sidecar.url)
+                sidecar.upload(sidecar_file)
                 logging.info("Uploading to %s", reference.url)
                 reference.upload(audio.filename)
 
+        sidecar = audio.with_suffix(sidecar_suffix)
+        logging.info("Uploading to %s", sidecar.url)
+        sidecar.upload(sidecar_file)
         logging.info("Uploading to %s", submission.audio_extracted.url)
         audio.upload(audio.filename)
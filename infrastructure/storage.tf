@@ -29,3 +29,19 @@ resource "google_storage_bucket" "audio_aligned" {
   name     = "${var.bucket_prefix}-audio-aligned"
   location = "US"
 }
+
+resource "google_storage_bucket" "cache" {
+  project  = google_project_service.storage.project
+  name     = "${var.bucket_prefix}-cache"
+  location = "US"
+
+  # Cached analysis can always be recomputed
+  lifecycle_rule {
+    condition {
+      age = 30
+    }
+    action {
+      type = "Delete"
+    }
+  }
+}
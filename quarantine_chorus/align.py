@@ -1,86 +1,1066 @@
 """Align wav data using cross-correlation (aka the fun part)"""
 
+import dataclasses as dc
+import functools
 import logging
+import re
+import threading
+from typing import Optional
 
 import numpy as np
-import scipy.signal as signal
+import scipy.fft as fft
 
 
-def _array_or_read_wav(array_or_filename, samplerate):
+def _array_or_read_wav(array_or_filename, samplerate, start=None, duration=None,
+                       stream=None, sample_format=None):
     if isinstance(array_or_filename, np.ndarray):
-        return array_or_filename
+        first = int(round((start or 0) * samplerate))
+        last = first + int(duration * samplerate) if duration else None
+        return array_or_filename[first:last]
     elif isinstance(array_or_filename, str):
         logging.info("Extracting pcm data from %s", array_or_filename)
         from .wav import read_wav
-        return read_wav(array_or_filename, samplerate)
+        return read_wav(array_or_filename, samplerate, start=start,
+                        duration=duration, stream=stream,
+                        sample_format=sample_format or 's16')
     else:
         raise ValueError("Expected a numpy array or a file name but got "
                          + type(array_or_filename))
 
 
+def _duration(array_or_filename, samplerate):
+    """Returns the duration in seconds of an array of samples or an audio file."""
+    if isinstance(array_or_filename, np.ndarray):
+        return len(array_or_filename) / samplerate
+    from .ffmpeg import probe
+    return probe(array_or_filename).duration
+
+
+class Histogram:
+    """An exact histogram of 8 or 16 bit integer samples.
+
+    Computes percentiles without copying or partitioning the signal. Blocks can be
+    added one at a time, so this works with streamed audio.
+    """
+    def __init__(self, dtype=np.int16):
+        dtype = np.dtype(dtype)
+        bits = 8 * dtype.itemsize
+        self.unsigned = np.dtype(f'u{dtype.itemsize}')
+        # Flipping the sign bit maps signed integers onto unsigned in the same order
+        self.flip = self.unsigned.type(1 << (bits - 1) if dtype.kind == 'i' else 0)
+        self.min = -(1 << (bits - 1)) if dtype.kind == 'i' else 0
+        self.counts = np.zeros(1 << bits, dtype=np.int64)
+        self.total = 0
+
+    def update(self, block):
+        offset = block.view(self.unsigned) ^ self.flip
+        self.counts += np.bincount(offset, minlength=len(self.counts))
+        self.total += len(block)
+
+    def percentile(self, q):
+        """Same as np.percentile (with the default linear interpolation)."""
+        cumulative = np.cumsum(self.counts)
+        rank = q / 100 * (self.total - 1)
+        lo, hi = np.searchsorted(cumulative, [np.floor(rank), np.ceil(rank)],
+                                 side='right')
+        lo, hi = int(lo) + self.min, int(hi) + self.min
+        return lo + (hi - lo) * (rank - np.floor(rank))
+
+
+# Number of set bits in each byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class BitMask:
+    """A bit-packed activity mask, with one bit per sample (see np.packbits).
+
+    Loudness gating leaves a signal with only two values, so a mask carries the same
+    information as the gated PCM in a sixteenth of the memory. Masks can be
+    correlated directly (see `correlate_shifts`), and reduced to activity counts for
+    coarse correlation (see `counts`). `len()` is the number of samples.
+    """
+    def __init__(self, packed, length):
+        self.packed = packed
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def _bytes(self, bit_offset, nbytes):
+        """Returns `nbytes` bytes of the mask starting at any bit (zero past the end)."""
+        q, r = divmod(bit_offset, 8)
+        chunk = self.packed[q:q + nbytes + 1]
+        if len(chunk) < nbytes + 1:
+            chunk = np.concatenate([chunk, np.zeros(nbytes + 1 - len(chunk),
+                                                    dtype=np.uint8)])
+        if not r:
+            return chunk[:nbytes]
+        # packbits stores the first sample in the most significant bit
+        return (chunk[:-1] << r) | (chunk[1:] >> (8 - r))
+
+    def counts(self, factor, block_size=2**16):
+        """Returns the number of active samples in each frame of `factor` samples.
+
+        `factor` must be a multiple of 8. Returns float32, like `envelope`.
+        """
+        step = factor // 8
+        n = self.length // factor
+        out = np.empty(n, dtype=np.float32)
+        rows = max(1, block_size // step)
+        for i in range(0, n, rows):
+            j = min(i + rows, n)
+            block = POPCOUNT[self.packed[i * step:j * step]]
+            out[i:j] = block.reshape(j - i, step).sum(axis=1)
+        return out
+
+    def correlate_shifts(self, other, min_shift, max_shift, block_size=2**16):
+        """Same as `_correlate_shifts` on the unpacked masks, using popcounts.
+
+        Costs a pass over the mask for every shift, so this is for narrow windows
+        (e.g. refining a coarse shift).
+        """
+        out = np.zeros(max_shift - min_shift)
+        for i, shift in enumerate(range(min_shift, max_shift)):
+            # Shift `s` lines up subject sample `n` with reference sample `n + s + 1`
+            ref_start, subj_start = max(shift + 1, 0), max(-shift - 1, 0)
+            n = min(len(self) - ref_start, len(other) - subj_start)
+            nbytes = -(-n // 8)
+            for j in range(0, nbytes, block_size):
+                k = min(block_size, nbytes - j)
+                both = (self._bytes(ref_start + 8 * j, k)
+                        & other._bytes(subj_start + 8 * j, k))
+                out[i] += POPCOUNT[both].sum(dtype=np.int64)
+        return out
+
+
 class Preprocessor:
-    """Simple preprocessing algorithms
+    """Preprocessing engine.
 
-    Algorithms:
+    Works on the signal `block_size` samples at a time, so apart from the output
+    array the extra memory used is proportional to the block size. With
+    `inplace=True`, the output is written over the input signal (which must be
+    writable) instead.
+
+    Algorithms are registered in PREPROCESSORS (see `preprocessor`):
 
     - none: no-op
     - loudness: Selects samples in the loudest N percentile. Everything below
       the cutoff is silenced; everything above the cutoff is set to max gain.
+    - loudness_bits: Same as loudness, but returns a BitMask
+
+    Signals may be int16, int8, or uint8 (where 128 is silence; see
+    `wav.SAMPLE_FORMATS`).
+
+    The Aligner also accepts a family of envelope algorithms, which reduce audio
+    to an energy envelope at a low frame rate (see `envelope`):
+
+    - rms_N: RMS envelope at N frames per second (e.g. rms_200)
+    - onset_N: onset envelope at N frames per second (e.g. onset_100)
     """
-    def __init__(self, wav):
+    def __init__(self, wav, inplace=False, block_size=2**16):
         self.wav = wav
+        self.inplace = inplace
+        # A multiple of 8, so that blocks pack into whole bytes
+        self.block_size = block_size
+        self.zero = 128 if wav.dtype == np.uint8 else 0
 
-    def none(self):
-        return self.wav
+    def blocks(self, out=None):
+        """Yields (input_block, output_block) views of the signal."""
+        for i in range(0, len(self.wav), self.block_size):
+            j = i + self.block_size
+            yield self.wav[i:j], (out[i:j] if out is not None else None)
 
-    def _loudness(self, ratio):
-        # Some files have fleeting very loud pops. Instead of the maximum,
-        # let's take a very high percentile, and hopefully that knocks off the
-        # extreme outliers
-        max_sample = np.percentile(self.wav, 99.5)
-        cutoff = int(ratio * max_sample)
-        # This is a bit more verbose than this one-liner:
-        #
-        #   return np.clip(self.wav - cutoff, 0, 1) * max_sample
+    def percentile(self, q):
+        """Computes a percentile of the signal, using a histogram for integers."""
+        if self.wav.dtype not in (np.int16, np.int8, np.uint8):
+            return np.percentile(self.wav, q)
+        histogram = Histogram(self.wav.dtype)
+        for block, _ in self.blocks():
+            histogram.update(block)
+        return histogram.percentile(q) - self.zero
+
+    def output(self):
+        """Returns an array to write output to."""
+        return self.wav if self.inplace else np.empty_like(self.wav)
+
+    def threshold(self, cutoff, value):
+        """Sets samples above `cutoff` to `value`, and everything else to 0."""
+        out = self.output()
+        mask = np.empty(min(self.block_size, len(self.wav)), dtype=bool)
+        for block, out_block in self.blocks(out):
+            block_mask = mask[:len(block)]
+            np.greater(block, cutoff + self.zero, out=block_mask)
+            np.multiply(block_mask, value, out=out_block, casting='unsafe')
+        return out
+
+    def mask(self, cutoff):
+        """Returns a BitMask of the samples above `cutoff`."""
+        packed = np.empty(-(-len(self.wav) // 8), dtype=np.uint8)
+        for i, (block, _) in enumerate(self.blocks()):
+            j = i * self.block_size // 8
+            block_packed = np.packbits(block > cutoff + self.zero)
+            packed[j:j + len(block_packed)] = block_packed
+        return BitMask(packed, len(self.wav))
+
+
+PREPROCESSORS = {}
+
+
+def preprocessor(name, **params):
+    """Decorator that registers a preprocessing algorithm as `name`.
+
+    The decorated function is called with a Preprocessor and `params`, and returns
+    the processed signal.
+    """
+    def decorator(f):
+        PREPROCESSORS[name] = functools.partial(f, **params)
+        return f
+    return decorator
+
+
+@preprocessor('none')
+def _none(p):
+    return p.wav
+
+
+@preprocessor('loudness_25', ratio=0.25)  # the loudest 75% of samples
+@preprocessor('loudness_50', ratio=0.5)   # the loudest 50% of samples
+@preprocessor('loudness_75', ratio=0.75)  # the loudest 25% of samples
+def _loudness(p, ratio):
+    # Some files have fleeting very loud pops. Instead of the maximum,
+    # let's take a very high percentile, and hopefully that knocks off the
+    # extreme outliers
+    max_sample = p.percentile(99.5)
+    cutoff = int(ratio * max_sample)
+    # Same as `np.clip(wav - cutoff, 0, 1) * max_sample`, but without any
+    # full-size temporary arrays
+    return p.threshold(cutoff, int(max_sample))
+
+
+@preprocessor('loudness_25_bits', ratio=0.25)
+@preprocessor('loudness_50_bits', ratio=0.5)
+@preprocessor('loudness_75_bits', ratio=0.75)
+def _loudness_bits(p, ratio):
+    # Same cutoff as `_loudness`; the gated signal's two values become bits
+    return p.mask(int(ratio * p.percentile(99.5)))
+
+
+def preprocess(wav_data, algorithm, inplace=False):
+    """Processes a wav file before running cross-correlation."""
+    try:
+        f = PREPROCESSORS[algorithm]
+    except KeyError:
+        raise ValueError(f"Unknown preprocess algorithm '{algorithm}'. "
+                         f"Expected one of {list(PREPROCESSORS.keys())}")
+    return f(Preprocessor(wav_data, inplace=inplace))
+
+
+def _abs_argmax(a):
+    """Returns (index, abs_value) of the largest absolute value, without a copy."""
+    i, j = int(np.argmax(a)), int(np.argmin(a))
+    if abs(a[j]) > abs(a[i]):
+        i = j
+    return i, abs(a[i])
+
+
+def _best_shift(corr, corr_zero, min_shift, max_shift):
+    """Finds the shift with the highest absolute correlation within the window.
+
+    `corr_zero` is the index in `corr` of no shift. Returns (shift, abs_value).
+    """
+    corr_slice = corr[max(0, corr_zero + min_shift):corr_zero + max_shift]
+    min_shift = max(min_shift, -corr_zero)
+    corr_best_index, corr_best = _abs_argmax(corr_slice)
+    return corr_best_index + min_shift, corr_best
+
+
+def correlation_curve(corr, points, scale=1.0):
+    """Reduces a correlation to at most `points` values, for plotting.
+
+    Each value is the largest absolute correlation in its span of `step` entries,
+    divided by `scale`. Returns (curve, step). Only allocates the curve itself.
+    """
+    step = max(1, -(-len(corr) // points))
+    starts = np.arange(0, len(corr), step)
+    curve = np.abs(np.maximum.reduceat(corr, starts))
+    np.maximum(curve, np.abs(np.minimum.reduceat(corr, starts)), out=curve)
+    curve /= scale
+    return curve, step
+
+
+@dc.dataclass
+class AlignmentResult:
+    """The result of aligning a subject.
+
+    `analysis` is the analysis map (see `cross_correlate`). Depending on the
+    `correlation` mode, there may also be correlation data, normalized so that the
+    peak is 1:
+
+    - correlation  the correlation; entry `i` is for a shift of
+                   `shift_start + i * shift_step` samples
+    - curve        the largest absolute correlation for every `curve_step` shifts,
+                   starting with `shift_start`
+
+    Shifts are in samples at `analysis['correlation_samplerate']`. Unpacks into
+    (analysis, correlation), like a tuple.
+    """
+    analysis: dict
+    correlation: Optional[np.ndarray] = None
+    curve: Optional[np.ndarray] = None
+    shift_start: int = 0
+    shift_step: int = 1
+    curve_step: int = 1
+
+    @property
+    def shift(self):
+        """Best shift in samples (negative: trim; positive: pad)."""
+        return self.analysis['correlation_shift']
+
+    @property
+    def peak(self):
+        """Absolute (un-normalized) correlation at the best shift."""
+        return self.analysis.get('correlation_peak')
+
+    def curve_shifts(self):
+        """Returns the first shift of each point in `curve`."""
+        return self.shift_start + self.curve_step * np.arange(len(self.curve))
+
+    def __iter__(self):
+        return iter((self.analysis, self.correlation))
+
+
+class _FFTCorrelator:
+    """Correlates any number of signals against `wav`, caching its padded rFFT.
+
+    Transforms are computed in `dtype` (float32 halves memory use compared with
+    float64) using `workers` threads.
+    """
+    def __init__(self, wav, dtype=np.float64, workers=None):
+        self.wav = wav
+        self.dtype = dtype
+        self.workers = workers
+        self._spectrum = (0, None)
+
+    def spectrum(self, size):
+        """Returns (nfft, rfft of wav) with nfft of at least `size`."""
+        nfft, spectrum = self._spectrum
+        if nfft < size:
+            # Leave room for a subject as long as the reference, so that aligning a
+            # whole song's worth of submissions only needs a single transform.
+            nfft = fft.next_fast_len(max(size, 2 * len(self.wav) - 1), real=True)
+            logging.info('Computing reference rfft with %d points', nfft)
+            spectrum = fft.rfft(self.wav.astype(self.dtype, copy=False), nfft,
+                                workers=self.workers)
+            self._spectrum = (nfft, spectrum)
+        return nfft, spectrum
+
+    def correlate(self, subj_wav):
+        """Same as `signal.fftconvolve(wav, subj_wav[::-1], mode='full')`."""
+        # The following discussion uses `f` and `g` to discuss the two input
+        # signals. In our case, `f` is the reference, and `g` is the subject
+        # Cross-correlation can be computed using convolution if you reverse `g`
+        # https://en.wikipedia.org/wiki/Cross-correlation
         #
-        # ... but it does everything in-place (after the first copy), which saves some
-        # memory
-        if True:
-            normalized = self.wav - cutoff
-            np.clip(normalized, 0, 1, out=normalized)
-            normalized *= int(max_sample)
-            return normalized
+        # This would also work, except that we want to reuse the reference fft
+        # corr = signal.fftconvolve(ref_wav, subj_wav[::-1], mode='full')
+        size = len(self.wav) + len(subj_wav) - 1
+        nfft, spectrum = self.spectrum(size)
+        subj_spectrum = fft.rfft(subj_wav[::-1].astype(self.dtype, copy=False), nfft,
+                                 workers=self.workers)
+        subj_spectrum *= spectrum
+        return fft.irfft(subj_spectrum, nfft, workers=self.workers)[:size]
+
+
+ENVELOPE_RE = re.compile(r'^(rms|onset)_(\d+)$')
+
+
+def envelope(wav, factor, kind='rms', block_size=2**16):
+    """Reduces a signal to an envelope with one value for every `factor` samples.
+
+    Kinds:
+
+    - mean: mean absolute value of each frame
+    - rms: root mean square of each frame
+    - onset: increase in log RMS from the previous frame (half-wave rectified), which
+      emphasizes note onsets over sustained notes
+
+    Converts at most `block_size` samples to floating point at a time, so memory use
+    scales with the output size rather than the input size.
+    """
+    n = len(wav) // factor
+    frames = wav[:n * factor].reshape(n, factor)
+    out = np.empty(n, dtype=np.float32)
+    step = max(1, block_size // factor)
+    for i in range(0, n, step):
+        block = frames[i:i + step].astype(np.float32)
+        if kind == 'mean':
+            np.abs(block, out=block)
         else:
-            return np.clip(self.wav - cutoff, 0, 1) * max_sample
+            block *= block
+        block.mean(axis=1, out=out[i:i + step])
+    if kind != 'mean':
+        np.sqrt(out, out=out)
+    if kind == 'onset':
+        np.log1p(out, out=out)
+        out[1:] = np.diff(out)
+        out[:1] = 0
+        np.maximum(out, 0, out=out)
+    return out
 
-    def loudness_25(self):
-        """Selects the 25th percentile of samples (i.e. the loudest 75%)"""
-        return self._loudness(0.25)
 
-    def loudness_50(self):
-        """Selects the 50th percentile of samples (i.e. the loudest 50%)"""
-        return self._loudness(0.5)
+def _correlate_shifts(ref_wav, subj_wav, min_shift, max_shift,
+                      block_size=2**16, dtype=np.float64):
+    """Computes the correlation only for shifts between min_shift and max_shift.
 
-    def loudness_75(self):
-        """Selects the 75th percentile of samples (i.e. the loudest 25%)"""
-        return self._loudness(0.75)
+    Values are the same as the full correlation at `corr_zero + shift`. This is a
+    direct evaluation, so it takes O(window * len(subj_wav)) time but only
+    O(block_size + window) memory. Use it for narrow windows.
+    """
+    width = max_shift - min_shift
+    out = np.zeros(width, dtype=dtype)
+    for start in range(0, len(subj_wav), block_size):
+        subj_block = subj_wav[start:start + block_size].astype(dtype)
+        # Reference samples that line up with this block for any shift in the window
+        lo = start + min_shift + 1
+        hi = start + len(subj_block) + max_shift
+        if hi <= 0 or lo >= len(ref_wav):
+            continue
+        ref_block = ref_wav[max(lo, 0):min(hi, len(ref_wav))].astype(dtype)
+        ref_block = np.pad(ref_block, (max(-lo, 0), max(hi - len(ref_wav), 0)))
+        out += np.correlate(ref_block, subj_block, mode='valid')
+    return out
 
 
-def preprocess(wav_data, algorithm):
-    """Processes a wav file before running cross-correlation."""
-    return getattr(Preprocessor(wav_data), algorithm)()
+def _correlate_blocks(ref_wav, subj_wav, min_shift, max_shift, block_size,
+                      dtype=np.float64, workers=None):
+    """Computes the correlation only for shifts between min_shift and max_shift.
+
+    Values are the same as `_correlate_shifts`, but each block of `block_size`
+    subject samples is correlated using an FFT (overlap-save), so this takes
+    O(len(subj_wav) * log(block_size + window)) time and O(block_size + window)
+    memory.
+    """
+    width = max_shift - min_shift
+    nfft = fft.next_fast_len(block_size + width - 1, real=True)
+    out = np.zeros(width, dtype=dtype)
+    for start in range(0, len(subj_wav), block_size):
+        subj_block = subj_wav[start:start + block_size].astype(dtype)
+        lo = start + min_shift + 1
+        hi = start + len(subj_block) + max_shift
+        if hi <= 0 or lo >= len(ref_wav):
+            continue
+        ref_block = ref_wav[max(lo, 0):min(hi, len(ref_wav))].astype(dtype)
+        ref_block = np.pad(ref_block, (max(-lo, 0), max(hi - len(ref_wav), 0)))
+        spectrum = fft.rfft(ref_block, nfft, workers=workers)
+        spectrum *= fft.rfft(subj_block[::-1], nfft, workers=workers)
+        # Only the last `width` points of the linear convolution are complete; the
+        # circular wrap-around only pollutes the points before them.
+        n = len(subj_block)
+        out += fft.irfft(spectrum, nfft, workers=workers)[n - 1:n - 1 + width]
+    return out
+
+
+# Rough cost of one FFT point (per log2 of the FFT size) relative to one
+# multiply-add in a direct correlation, as measured with numpy and scipy.fft.
+FFT_COST = 8
+
+
+def _block_size(width):
+    """Picks an overlap-save block size for a shift window `width` samples wide."""
+    return 2 ** max(14, int(np.ceil(np.log2(4 * width))))
+
+
+def choose_method(ref_len, subj_len, width):
+    """Picks the cheapest correlation method for a shift window.
+
+    Returns one of:
+
+    - fft     correlate the full signals using one large FFT
+    - direct  evaluate each shift in the window directly (narrow windows)
+    - blocks  overlap-save FFT correlation of subject blocks (medium windows)
+    """
+    def fft_cost(n):
+        return 3 * FFT_COST * n * np.log2(n)
+    block_size = _block_size(width)
+    costs = {
+        'fft': fft_cost(ref_len + subj_len),
+        'direct': width * subj_len,
+        'blocks': (np.ceil(subj_len / block_size)
+                   * fft_cost(fft.next_fast_len(block_size + width - 1, real=True))),
+    }
+    return min(costs, key=costs.get)
+
+
+def _correlate_window(ref_wav, subj_wav, min_shift, max_shift, method='auto',
+                      dtype=np.float64, workers=None):
+    """Computes the correlation for shifts between min_shift and max_shift."""
+    if isinstance(ref_wav, BitMask):
+        return ref_wav.correlate_shifts(subj_wav, min_shift, max_shift)
+    width = max_shift - min_shift
+    if method == 'auto':
+        method = choose_method(len(ref_wav), len(subj_wav), width)
+        if method == 'fft':
+            method = 'blocks'
+    if method == 'direct':
+        return _correlate_shifts(ref_wav, subj_wav, min_shift, max_shift,
+                                 dtype=dtype)
+    else:
+        return _correlate_blocks(ref_wav, subj_wav, min_shift, max_shift,
+                                 _block_size(width), dtype=dtype, workers=workers)
+
+
+def estimate_memory(ref_len, subj_len, width=None, factor=1, dtype=np.float64,
+                    copy=False, sample_bytes=2, bits=False):
+    """Estimates the peak bytes an alignment allocates (on top of the interpreter).
+
+    `ref_len` and `subj_len` are in full rate samples, `width` is the shift window
+    (None for the whole correlation), and `factor` is the coarse decimation factor.
+    `copy` is true when preprocessing has to copy the inputs (arrays rather than
+    decoded files). `sample_bytes` is the size of decoded samples, and `bits` is
+    true for BitMask preprocessing. The constants are measured with tracemalloc.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    if bits:
+        # Masks for both signals, plus one decoded signal at a time
+        total = (ref_len + subj_len) // 8 + sample_bytes * max(ref_len, subj_len)
+    else:
+        # pcm for both signals, which stays around for the whole alignment
+        total = sample_bytes * (ref_len + subj_len) * (2 if copy else 1)
+    if factor > 1:
+        # float32 envelopes, correlated in full, then a small full rate refinement
+        ref_len, subj_len = ref_len // factor, subj_len // factor
+        total += 4 * (ref_len + subj_len)
+        total += 8 * fft.next_fast_len(_block_size(4 * factor) + 4 * factor,
+                                       real=True) * itemsize
+        width = None
+    if width is None or choose_method(ref_len, subj_len, width) == 'fft':
+        # The reference spectrum (sized for a subject as long as the reference), the
+        # converted subject, its spectrum, and the correlation
+        nfft = fft.next_fast_len(max(ref_len + subj_len - 1, 2 * ref_len - 1),
+                                 real=True)
+        total += 3 * nfft * itemsize + subj_len * itemsize
+    else:
+        block_size = _block_size(width)
+        total += 8 * fft.next_fast_len(block_size + width, real=True) * itemsize
+    return total
+
+
+# Lowest sample rate the planner will fall back to, and the rate used for coarse
+# correlation when the planner (or a BitMask preprocess algorithm) turns it on
+MIN_SAMPLERATE = 8000
+COARSE_SAMPLERATE = 1000
+
+BITS_RE = re.compile(r'_bits$')
+
+
+def coarse_factor(samplerate, preprocess=None, coarse_samplerate=None):
+    """Returns the decimation factor for coarse correlation (1 for none).
+
+    Envelope algorithms are always decimated to their frame rate, and BitMask
+    algorithms to a multiple of 8 samples (whole bytes).
+    """
+    envelope_algorithm = ENVELOPE_RE.match(preprocess or '')
+    if envelope_algorithm:
+        return max(2, int(samplerate // int(envelope_algorithm.group(2))))
+    elif BITS_RE.search(preprocess or ''):
+        factor = int(samplerate // (coarse_samplerate or COARSE_SAMPLERATE))
+        return max(8, factor // 8 * 8)
+    elif coarse_samplerate:
+        return int(samplerate // coarse_samplerate)
+    else:
+        return 1
+
+
+@dc.dataclass
+class AlignmentPlan:
+    """How to run an alignment so that it fits in a memory budget.
+
+    See `plan_alignment`.
+    """
+    samplerate: int
+    dtype: str = 'float64'
+    coarse_samplerate: Optional[int] = None
+    analysis_duration: Optional[float] = None
+    reference_duration: float = 0.0
+    subject_duration: float = 0.0
+    estimated_peak_mb: float = 0.0
+    fits: bool = True
+
+    def estimate(self, samplerate, kwargs, copy=False):
+        """Updates `estimated_peak_mb` for these settings.
+
+        `samplerate` and `kwargs` are the requested ones, which shifts are in.
+        """
+        preprocess = kwargs.get('preprocess')
+        factor = coarse_factor(self.samplerate, preprocess, self.coarse_samplerate)
+        subj_duration = self.subject_duration
+        if self.analysis_duration is not None:
+            subj_duration = min(subj_duration, self.analysis_duration)
+        width = None
+        min_shift, max_shift = kwargs.get('min_shift'), kwargs.get('max_shift')
+        if min_shift is not None and max_shift is not None \
+                and kwargs.get('method') != 'fft':
+            width = (max_shift - min_shift) * self.samplerate // samplerate
+        self.estimated_peak_mb = estimate_memory(
+            int(self.reference_duration * self.samplerate),
+            int(subj_duration * self.samplerate),
+            width, factor, self.dtype, copy,
+            sample_bytes=1 if kwargs.get('sample_format') in ('s8', 'u8') else 2,
+            bits=bool(BITS_RE.search(preprocess or '')),
+        ) / 2**20
+        return self
+
+    def aligner_kwargs(self):
+        """Returns the Aligner kwargs that this plan overrides."""
+        kwargs = {'samplerate': self.samplerate, 'dtype': self.dtype}
+        if self.coarse_samplerate:
+            kwargs['coarse_samplerate'] = self.coarse_samplerate
+        if self.analysis_duration is not None:
+            kwargs['analysis_duration'] = self.analysis_duration
+        return kwargs
+
+
+def plan_alignment(reference_duration, subject_duration, samplerate,
+                   memory_budget_mb, fixed_samplerate=False, copy=False, **kwargs):
+    """Picks alignment settings whose estimated peak memory fits in a budget.
+
+    Durations are in seconds; kwargs are the rest of the `cross_correlate` kwargs.
+    Starting from the requested settings, the planner gives up as little accuracy as
+    it can, in this order, until the estimate fits:
+
+    1. float32 instead of float64 (no practical loss)
+    2. coarse-to-fine correlation at COARSE_SAMPLERATE (the fine search still runs
+       at full rate)
+    3. halving the sample rate, down to MIN_SAMPLERATE (unless `fixed_samplerate`,
+       e.g. for inputs that are already decoded)
+    4. only analyzing the start of the subject (halving the analyzed duration down
+       to a minute)
+
+    If even that doesn't fit, returns the cheapest plan with `fits` set to false.
+    """
+    plan = AlignmentPlan(
+        samplerate=samplerate,
+        dtype=np.dtype(kwargs.get('dtype') or np.float64).name,
+        coarse_samplerate=kwargs.get('coarse_samplerate'),
+        analysis_duration=kwargs.get('analysis_duration'),
+        reference_duration=reference_duration,
+        subject_duration=subject_duration,
+    )
+
+    def degrade():
+        """Yields after each change to `plan`, starting with no change."""
+        yield
+        if plan.dtype != 'float32':
+            plan.dtype = 'float32'
+            yield
+        if not plan.coarse_samplerate and coarse_factor(
+                plan.samplerate, kwargs.get('preprocess')) == 1:
+            plan.coarse_samplerate = COARSE_SAMPLERATE
+            yield
+        while not fixed_samplerate and plan.samplerate // 2 >= MIN_SAMPLERATE:
+            plan.samplerate //= 2
+            yield
+        while (plan.analysis_duration or subject_duration) / 2 >= 60:
+            plan.analysis_duration = (plan.analysis_duration or subject_duration) / 2
+            yield
+
+    for _ in degrade():
+        plan.estimate(samplerate, kwargs, copy)
+        if plan.estimated_peak_mb <= memory_budget_mb:
+            return plan
+    plan.fits = False
+    return plan
+
+
+class Aligner:
+    """Aligns any number of subjects against a single reference.
+
+    The reference is read and preprocessed once (on first use), and its padded
+    rFFT is computed once and reused for every subject, so aligning a song's worth
+    of submissions costs a single reference decode and transform. An Aligner may be
+    shared between threads.
+
+    Takes the same arguments as `cross_correlate` (minus the subject).
+    """
+    def __init__(self, reference, samplerate, cache=None, **kwargs):
+        self.reference = reference
+        self.samplerate = samplerate
+        self.cache = cache
+        self.kwargs = kwargs
+        self._lock = threading.RLock()
+        self._correlators = {}
+        self._reference_hash = None
+        self._reference_duration = None
+        self._planned = (None, None)
+
+    def _envelope(self):
+        """Returns (kind, frame_rate) for envelope algorithms, otherwise None."""
+        m = ENVELOPE_RE.match(self.kwargs.get('preprocess') or '')
+        if m:
+            return m.group(1), int(m.group(2))
+
+    def _read(self, array_or_filename, start=None, duration=None):
+        """Reads and preprocesses a reference or subject.
+
+        Envelopes are computed later (see `_coarse`), so envelope algorithms leave
+        the full rate signal alone.
+        """
+        wav = _array_or_read_wav(array_or_filename, self.samplerate, start, duration,
+                                 self.kwargs.get('audio_stream'),
+                                 self.kwargs.get('sample_format'))
+        preprocess_algorithm = self.kwargs.get('preprocess')
+        if preprocess_algorithm and not self._envelope():
+            logging.info('Preprocessing wav data using %s', preprocess_algorithm)
+            # Decoded audio belongs to us, so there's no need to copy it
+            inplace = isinstance(array_or_filename, str) and wav.flags.writeable
+            wav = preprocess(wav, preprocess_algorithm, inplace=inplace)
+        return wav
+
+    def _fft_args(self):
+        """Returns dtype and workers args for correlation functions."""
+        return {
+            'dtype': np.dtype(self.kwargs.get('dtype') or np.float64),
+            'workers': self.kwargs.get('workers'),
+        }
+
+    def _coarse(self, wav, factor):
+        """Decimates a full rate signal for coarse correlation."""
+        if isinstance(wav, BitMask):
+            return wav.counts(factor)
+        kind = (self._envelope() or ('mean',))[0]
+        return envelope(wav, factor, kind)
+
+    def _correlator(self, factor):
+        """Returns the (cached) correlator for the reference decimated by `factor`."""
+        with self._lock:
+            correlator = self._correlators.get(factor)
+            if correlator is None:
+                if factor == 1:
+                    wav = self._read(self.reference)
+                else:
+                    wav = self._coarse(self._correlator(1).wav, factor)
+                correlator = self._correlators[factor] = _FFTCorrelator(
+                    wav, **self._fft_args()
+                )
+            return correlator
+
+    @property
+    def ref_wav(self):
+        """The preprocessed reference."""
+        return self._correlator(1).wav
+
+    # The correlation functions below return (shift, corr, corr_best, shift_start,
+    # shift_step), where `corr` is un-normalized, `corr_best` is its absolute peak
+    # value, and entry `i` of `corr` is for a shift of `shift_start + i * shift_step`
+
+    def _full_correlation(self, subj_wav, min_shift, max_shift):
+        """Correlates the full signals."""
+        corr = self._correlator(1).correlate(subj_wav)
+        # The location of no shift is at the end of `g` (see the Praat explanation
+        # in `align`)
+        corr_shift, corr_best = _best_shift(corr, len(subj_wav), min_shift, max_shift)
+        return corr_shift, corr, corr_best, -len(subj_wav), 1
+
+    def _coarse_to_fine(self, subj_wav, min_shift, max_shift, factor, refine_shift):
+        """Finds the best shift on decimated signals, then refines it at full rate.
+
+        The returned correlation is the coarse one; the full rate correlation is
+        never materialized. With a `refine_shift` of 0, skips the refinement and
+        returns the coarse shift, which is only accurate to about `factor` samples.
+        """
+        coarse_subj = self._coarse(subj_wav, factor)
+        coarse_corr = self._correlator(factor).correlate(coarse_subj)
+        coarse_shift, coarse_best = _best_shift(coarse_corr, len(coarse_subj),
+                                                min_shift // factor,
+                                                -(-max_shift // factor))
+        # Coarse shift `n` lines up block `i` of the subject with block `i + n + 1`
+        # of the reference; translate that back into a full rate shift.
+        center = (coarse_shift + 1) * factor - 1
+        coarse_start = (1 - len(coarse_subj)) * factor - 1
+        if not refine_shift:
+            return (min(max(center, min_shift), max_shift), coarse_corr, coarse_best,
+                    coarse_start, factor)
+        fine_min = max(min_shift, center - refine_shift)
+        fine_max = min(max_shift, center + refine_shift + 1)
+        logging.info('Refining shift between %d and %d samples', fine_min, fine_max)
+        fine_corr = _correlate_window(self.ref_wav, subj_wav, fine_min, fine_max,
+                                      **self._fft_args())
+        fine_index, _ = _abs_argmax(fine_corr)
+        return fine_min + fine_index, coarse_corr, coarse_best, coarse_start, factor
+
+    def _windowed_correlation(self, subj_wav, min_shift, max_shift, method):
+        """Correlates only shifts in the window."""
+        corr = _correlate_window(self.ref_wav, subj_wav, min_shift, max_shift, method,
+                                 **self._fft_args())
+        corr_best_index, corr_best = _abs_argmax(corr)
+        return corr_best_index + min_shift, corr, corr_best, min_shift, 1
+
+    def _subject_window(self):
+        """Returns (offset, duration) of the subject audio to read.
+
+        `offset` is in samples and `duration` is in seconds (None for the rest of
+        the subject). Subject samples that would line up before the start or past
+        the end of the reference for every shift in the window don't need to be
+        decoded at all. `analysis_start` and `analysis_duration` narrow the window
+        further.
+        """
+        kwargs = self.kwargs
+        offset = int(round((kwargs.get('analysis_start') or 0) * self.samplerate))
+        max_shift = kwargs.get('max_shift')
+        if max_shift is not None:
+            # Shift `s` lines up subject sample `n` with reference sample `n + s + 1`
+            offset = max(offset, -max_shift - 1)
+        durations = [kwargs.get('analysis_duration')]
+        min_shift = kwargs.get('min_shift')
+        if min_shift is not None:
+            durations.append((len(self.ref_wav) - min_shift - offset) / self.samplerate)
+        duration = min((d for d in durations if d is not None), default=None)
+        if duration is not None:
+            # A duration of 0 would mean all of it
+            duration = max(duration, 1 / self.samplerate)
+        return offset, duration
+
+    def plan(self, subject):
+        """Plans the alignment of `subject` to fit in `memory_budget_mb`.
+
+        See `plan_alignment`. Inputs are probed for their durations, without
+        decoding them.
+        """
+        kwargs = {k: v for k, v in self.kwargs.items() if k != 'memory_budget_mb'}
+        with self._lock:
+            if self._reference_duration is None:
+                self._reference_duration = _duration(self.reference, self.samplerate)
+        arrays = any(isinstance(x, np.ndarray) for x in (self.reference, subject))
+        # Preprocessing copies arrays, since they don't belong to us
+        copy = arrays and bool(kwargs.get('preprocess')) and not self._envelope()
+        plan = plan_alignment(self._reference_duration,
+                              _duration(subject, self.samplerate),
+                              self.samplerate, self.kwargs['memory_budget_mb'],
+                              # Arrays are already at self.samplerate
+                              fixed_samplerate=arrays, copy=copy, **kwargs)
+        logging.info('Alignment plan: %s', plan)
+        if not plan.fits:
+            logging.warning('Estimated peak memory of %d MB exceeds budget of %d MB',
+                            plan.estimated_peak_mb, self.kwargs['memory_budget_mb'])
+        return plan
+
+    def _planned_aligner(self, plan):
+        """Returns an Aligner that follows `plan`, reusing the last one if possible."""
+        kwargs = {k: v for k, v in self.kwargs.items() if k != 'memory_budget_mb'}
+        kwargs.update(plan.aligner_kwargs())
+        samplerate = kwargs.pop('samplerate')
+        # Shifts are in samples at the requested sample rate
+        for k in ('min_shift', 'max_shift', 'refine_shift'):
+            if kwargs.get(k):
+                kwargs[k] = kwargs[k] * samplerate // self.samplerate
+        key = (samplerate, sorted(kwargs.items()))
+        with self._lock:
+            if self._planned[0] != key:
+                self._planned = (key, Aligner(self.reference, samplerate, **kwargs))
+            return self._planned[1]
+
+    # Bump this when a change would alter cached analysis results
+    CACHE_VERSION = 3
+
+    def _cache_key(self, subject):
+        """Returns a cache key for aligning `subject` against the reference."""
+        from . import cache
+
+        def content_hash(array_or_filename):
+            if isinstance(array_or_filename, np.ndarray):
+                return cache.hash_array(array_or_filename)
+            else:
+                return cache.hash_file(array_or_filename)
+
+        if self._reference_hash is None:
+            self._reference_hash = content_hash(self.reference)
+        # Thread count and correlation data don't change the analysis
+        params = {k: v for k, v in self.kwargs.items()
+                  if k not in ('workers', 'correlation', 'curve_points')}
+        return 'alignment-' + cache.hash_params(self.CACHE_VERSION,
+                                                self._reference_hash,
+                                                content_hash(subject),
+                                                samplerate=self.samplerate,
+                                                **params)
+
+    def align(self, subject):
+        """Aligns a single subject, returning an AlignmentResult.
+
+        See `cross_correlate` for details.
+        """
+        if self.cache is None:
+            return self._align(subject)
+        from . import cache
+        key = self._cache_key(subject)
+        # Only the analysis is cached, so a hit can't provide correlation data
+        if (self.kwargs.get('correlation') or 'none') == 'none':
+            analysis = cache.get_json(self.cache, key)
+            if analysis is not None:
+                logging.info('Using cached alignment %s', key)
+                return AlignmentResult(analysis)
+        result = self._align(subject)
+        cache.set_json(self.cache, key, result.analysis)
+        return result
+
+    def _align(self, subject):
+        if self.kwargs.get('memory_budget_mb'):
+            plan = self.plan(subject)
+            result = self._planned_aligner(plan)._align(subject)
+            result.analysis['alignment_plan'] = dc.asdict(plan)
+            return result
+
+        samplerate = self.samplerate
+        kwargs = self.kwargs
+        ref_wav = self.ref_wav
+        offset, duration = self._subject_window()
+        if offset or duration:
+            logging.info('Reading %s seconds of the subject from %f seconds',
+                         duration or 'all', offset / samplerate)
+        subj_wav = self._read(subject, start=offset / samplerate, duration=duration)
+
+        # Clamp shift window
+        min_shift = kwargs.get('min_shift') or int(-len(subj_wav) / 2)
+        max_shift = kwargs.get('max_shift') or int(len(subj_wav) / 2)
+        logging.info('Clamping shift to between %f and %f seconds; %d and %d samples',
+                     min_shift / samplerate, max_shift / samplerate,
+                     min_shift, max_shift)
+        # Shifts of the subject we read are `offset` samples greater
+        window = (min_shift + offset, max_shift + offset)
+
+        # Pyramid mode: search on a decimated signal, then refine at full rate.
+        # Envelope algorithms are always decimated, and only refine if asked to.
+        # BitMasks are always decimated, and always refine with popcounts.
+        factor = coarse_factor(samplerate, kwargs.get('preprocess'),
+                               kwargs.get('coarse_samplerate'))
+        refine = kwargs.get('refine') if self._envelope() else True
+        if factor > 1:
+            logging.info('Coarse correlation at %d Hz (factor %d)',
+                         samplerate / factor, factor)
+            corr_shift, corr, corr_best, shift_start, shift_step = self._coarse_to_fine(
+                subj_wav, *window, factor,
+                (kwargs.get('refine_shift') or 2 * factor) if refine else 0,
+            )
+        else:
+            method = kwargs.get('method') or 'auto'
+            if method == 'auto':
+                method = choose_method(len(ref_wav), len(subj_wav),
+                                       max_shift - min_shift)
+            logging.info('Correlating using the %s method', method)
+            if method == 'fft':
+                correlate = self._full_correlation
+            else:
+                correlate = functools.partial(self._windowed_correlation,
+                                              method=method)
+            corr_shift, corr, corr_best, shift_start, shift_step = correlate(
+                subj_wav, *window
+            )
+        corr_shift -= offset
+        shift_start -= offset
+        logging.info('Best shift: %f seconds; %d samples',
+                     corr_shift / samplerate, corr_shift)
+
+        # This is how Praat explains cross-correlation offsets:
+        # http://www.fon.hum.uva.nl/praat/manual/Sounds__Cross-correlate___.html
+        # The start time of the resulting Sound will be the start time of `f` minus
+        # the end time of `g`, the end time of the resulting Sound will be the end
+        # time of `f` minus the start time of `g`, the time of the first sample of
+        # the resulting Sound will be the first sample of `f` minus the last sample
+        # of `g`, the time of the last sample of the resulting Sound will be the
+        # last sample of `f` minus the first sample of `g`, and the number of
+        # samples in the resulting Sound will be the sum of the numbers of samples
+        # of `f` and `g` minus 1.
+        ref_start, ref_end = 0, len(ref_wav)
+        subj_start, subj_end = offset, offset + len(subj_wav)
+        corr_start = ref_start - subj_end
+        corr_end = ref_end - subj_start
+
+        analysis = {
+            'correlation_start': corr_start,
+            'correlation_end': corr_end,
+            'correlation_shift': corr_shift,
+            'correlation_window_min': min_shift,
+            'correlation_window_max': max_shift,
+            'trim': -corr_shift if corr_shift < 0 else 0,
+            'pad': corr_shift if corr_shift > 0 else 0,
+        }
+        for k, v in list(analysis.items()):
+            analysis[k + '_seconds'] = v / samplerate
+        analysis['correlation_samplerate'] = samplerate
+        analysis['correlation_peak'] = float(corr_best)
+
+        result = AlignmentResult(analysis, shift_start=shift_start,
+                                 shift_step=shift_step)
+        mode = kwargs.get('correlation') or 'none'
+        if mode == 'full':
+            corr /= corr_best
+            result.correlation = corr
+        elif mode == 'curve':
+            result.curve, step = correlation_curve(corr, kwargs.get('curve_points')
+                                                   or 2000, corr_best)
+            result.curve_step = shift_step * step
+        elif mode != 'none':
+            raise ValueError(f"Unknown correlation mode '{mode}'")
+        return result
+
+    def align_many(self, subjects):
+        """Aligns each subject in turn, returning a list of `align` results."""
+        return [self.align(subject) for subject in subjects]
 
 
 def cross_correlate(reference, subject, samplerate, **kwargs):
-    """Runs a cross-correlation analysis, returning (analysis_map, correlation_data)
+    """Runs a cross-correlation analysis, returning an AlignmentResult.
+
+    The result unpacks into (analysis_map, correlation_data).
 
     `reference` and `subject` may be numpy 1-d arrays of samples, or audio filenames.
 
+    To align many subjects against the same reference, use an `Aligner` instead.
+
     kwargs:
 
     - min_shift   start of the correlation shift window (samples)
     - max_shift   end of the correlation shift window (samples)
-    - preprocess  preprocessing algorithm
+    - preprocess  preprocessing algorithm (see `Preprocessor`). The *_bits
+                  algorithms work on bit-packed masks, which always use
+                  coarse-to-fine correlation, refined with popcounts.
+    - coarse_samplerate  if set, find the shift on signals decimated to roughly this
+                         rate first, then refine at full rate (saves memory and time)
+    - refine_shift       samples on either side of the coarse shift to search at full
+                         rate (default: two coarse samples)
+    - refine      with an envelope preprocess algorithm (e.g. rms_200), refine the
+                  envelope's shift using the raw PCM (default: false)
+    - method      how to compute the correlation: fft, direct, blocks, or auto
+                  (default). Both direct and blocks compute only shifts inside the
+                  window; auto picks the cheapest method for the window size (see
+                  `choose_method`).
+    - dtype       floating point type for the correlation: float64 (default) or
+                  float32, which halves memory use
+    - workers     number of threads for FFTs (negative counts back from the number
+                  of CPUs, so -1 uses all of them)
+    - analysis_start     seconds of subject audio to skip without decoding
+    - analysis_duration  seconds of subject audio to analyze (default: all of it)
+    - audio_stream       index of the audio stream to decode (default: the first)
+    - sample_format      decoded sample format: s16 (default), s8, or u8 (see
+                         `wav.SAMPLE_FORMATS`). 8-bit samples halve decoding memory,
+                         and are enough for the loudness algorithms.
+    - memory_budget_mb   if set, plan the alignment so that its estimated peak memory
+                         fits in this many megabytes, by lowering precision, sample
+                         rate, and analysis duration as needed (see
+                         `plan_alignment`). min_shift and max_shift are still in
+                         samples at `samplerate`.
+    - correlation what correlation data to return: none (default, just the
+                  analysis), curve (at most `curve_points` values, default 2000,
+                  for plotting), or full (the whole normalized correlation, which
+                  is the only mode that keeps a correlation-sized array around)
+    - cache       a store from `quarantine_chorus.cache` (e.g. LocalStore or
+                  GCSStore). Results are cached by the content of both inputs and
+                  the correlation parameters. Only the analysis is cached, so
+                  the cache is only read in the none correlation mode.
+
+    When `min_shift` or `max_shift` is given, subject audio that can't affect any
+    shift in the window isn't decoded (see `wav.read_wav` for seeking). For a long
+    recording, setting both (plus `analysis_duration`) means only a minute or two
+    is decoded.
 
     Returned analysis keys:
 
@@ -93,67 +1073,13 @@ def cross_correlate(reference, subject, samplerate, **kwargs):
     - pad                     samples to add to the beginning of subj_wav
 
     Note: the above analysis values are in samples; the analysis also returns
-    values converted to seconds. These keys have a `_seconds` suffix.
-    """
-    # Read wav files and preprocess
-    ref_wav = _array_or_read_wav(reference, samplerate)
-    subj_wav = _array_or_read_wav(subject, samplerate)
-    preprocess_algorithm = kwargs.get('preprocess')
-    if preprocess_algorithm:
-        logging.info('Preprocessing wav data using %s', preprocess_algorithm)
-        ref_wav = preprocess(ref_wav, preprocess_algorithm)
-        subj_wav = preprocess(subj_wav, preprocess_algorithm)
-    # return {}
-
-    # Clamp shift window
-    min_shift = kwargs.get('min_shift') or int(-len(subj_wav) / 2)
-    max_shift = kwargs.get('max_shift') or int(len(subj_wav) / 2)
-
-    # The following discussion uses `f` and `g` to discuss the two input
-    # signals. In our case, `f` is the reference, and `g` is the subject
-    # Cross-correlation can be computed using convolution if you reverse `g`
-    # https://en.wikipedia.org/wiki/Cross-correlation
-    corr = signal.fftconvolve(ref_wav, subj_wav[::-1], mode='full')
-
-    # This would also work, except that we want to correlate using fft
-    # corr = signal.correlate(data1, data2, mode='full')
-
-    # This is how Praat explains cross-correlation offsets:
-    # http://www.fon.hum.uva.nl/praat/manual/Sounds__Cross-correlate___.html
-    # The start time of the resulting Sound will be the start time of `f` minus
-    # the end time of `g`, the end time of the resulting Sound will be the end
-    # time of `f` minus the start time of `g`, the time of the first sample of
-    # the resulting Sound will be the first sample of `f` minus the last sample
-    # of `g`, the time of the last sample of the resulting Sound will be the
-    # last sample of `f` minus the first sample of `g`, and the number of
-    # samples in the resulting Sound will be the sum of the numbers of samples
-    # of `f` and `g` minus 1.
-    ref_start, ref_end = 0, len(ref_wav)
-    subj_start, subj_end = 0, len(subj_wav)
-    corr_start = ref_start - subj_end
-    corr_end = ref_end - subj_start
-
-    # Find the best correlation point (highest value)
-    corr_zero = -corr_start  # the location of no shift
-    corr_slice = corr[corr_zero + min_shift:corr_zero + max_shift]
-    logging.info('Clamping shift to between %f and %f seconds; %d and %d samples',
-                 min_shift / samplerate, max_shift / samplerate,
-                 min_shift, max_shift)
-    corr_best_index = int(np.argmax(np.abs(corr_slice)))
-    corr_best = abs(corr_slice[corr_best_index])
-    corr_shift = corr_best_index + min_shift
-    logging.info('Best shift: %f seconds; %d samples',
-                 corr_shift / samplerate, corr_shift)
-
-    analysis = {
-        'correlation_start': corr_start,
-        'correlation_end': corr_end,
-        'correlation_shift': corr_shift,
-        'correlation_window_min': min_shift,
-        'correlation_window_max': max_shift,
-        'trim': -corr_shift if corr_shift < 0 else 0,
-        'pad': corr_shift if corr_shift > 0 else 0,
-    }
-    for k, v in list(analysis.items()):
-        analysis[k + '_seconds'] = v / samplerate
-    return analysis, corr / corr_best
+    values converted to seconds. These keys have a `_seconds` suffix. Samples are
+    at `correlation_samplerate`, which is lower than `samplerate` when a memory
+    budget required it; the plan itself is in `alignment_plan`. The absolute
+    (un-normalized) correlation at the best shift is in `correlation_peak`.
+
+    When using `coarse_samplerate`, correlation data is the coarse correlation, at
+    the coarse sample rate. When using the direct or blocks method, it only covers
+    the shift window. See `AlignmentResult` for how to map it back to shifts.
+    """
+    return Aligner(reference, samplerate, **kwargs).align(subject)
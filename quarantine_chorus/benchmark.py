@@ -0,0 +1,302 @@
+"""Alignment and encoding benchmarks.
+
+Usage:
+
+    python -m quarantine_chorus.benchmark align [options] > results.jsonl
+    python -m quarantine_chorus.benchmark encode [options] > results.jsonl
+
+`align` uses synthetic signals with a known shift, and prints one JSON object per
+run, with wall time, peak memory, and shift error in samples. Each run happens in a
+fresh process so that peak RSS is meaningful.
+
+`encode` encodes sample media (synthetic by default) with each encode profile the
+way align_video does, and prints one JSON object per run, with encode speed, CPU
+time, and output size.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+
+# == Synthetic signals ==
+
+def _phrases(rng, duration):
+    """Returns a list of (start, length, frequency) notes for a synthetic song."""
+    notes = []
+    t = rng.uniform(0.5, 2)
+    while t < duration:
+        # A phrase of a few notes, then a rest
+        for _ in range(rng.integers(3, 9)):
+            length = rng.uniform(0.2, 1.2)
+            notes.append((t, length, 110 * 2 ** rng.uniform(0, 2)))
+            t += length
+        t += rng.uniform(0.2, 2)
+    return notes
+
+
+def _sing(notes, samplerate, duration, harmonics, detune=1.0):
+    """Renders notes as int16 PCM, using one harmonic series for the voice."""
+    out = np.zeros(int(duration * samplerate), dtype=np.float32)
+    for start, length, frequency in notes:
+        i = int(start * samplerate)
+        n = min(int(length * samplerate), len(out) - i)
+        if n <= 0:
+            continue
+        t = np.arange(n, dtype=np.float32) / samplerate
+        note = np.zeros(n, dtype=np.float32)
+        for k, amplitude in enumerate(harmonics, start=1):
+            note += amplitude * np.sin(2 * np.pi * frequency * detune * k * t)
+        # 50 ms attack and release
+        ramp = min(n // 2, int(0.05 * samplerate))
+        note[:ramp] *= np.linspace(0, 1, ramp, dtype=np.float32)
+        note[n - ramp:] *= np.linspace(1, 0, ramp, dtype=np.float32)
+        out[i:i + n] += note
+    return out
+
+
+def _to_int16(signal):
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+
+def synthetic_pair(samplerate, duration=60, shift=1.5, noise=0.02, pops=5,
+                   silence=1.0, seed=0, exact=False):
+    """Generates a (reference, subject, expected_shift) triple.
+
+    The subject sings the same notes as the reference, with a different voice, plus
+    background noise, a few loud pops, and `silence` extra seconds of leading
+    silence. The subject starts `shift` seconds after the reference (negative
+    shifts start before it). With `exact`, the subject is the reference, only
+    shifted, so alignment should find `expected_shift` exactly.
+
+    `expected_shift` is in samples, using the same convention as the analysis
+    `correlation_shift`: negative means trim the subject, and a subject delayed
+    by N samples has a shift of -(N + 1).
+    """
+    rng = np.random.default_rng(seed)
+    notes = _phrases(rng, duration)
+    level = 8000
+    reference = _to_int16(level * _sing(notes, samplerate, duration,
+                                        harmonics=[1, 0.5, 0.25, 0.12]))
+    if exact:
+        subject = reference.copy()
+    else:
+        subject = level * _sing(notes, samplerate, duration,
+                                harmonics=[0.6, 0.8, 0.3, 0.3, 0.1],
+                                detune=2 ** rng.uniform(-0.01, 0.01))
+        subject += rng.normal(0, noise * level, len(subject)).astype(np.float32)
+        for i in rng.integers(0, len(subject), pops):
+            subject[i:i + samplerate // 1000] = 32767
+        subject = _to_int16(subject)
+    # Shift the subject
+    offset = int(round((shift + silence) * samplerate))
+    if offset >= 0:
+        subject = np.concatenate([np.zeros(offset, dtype=np.int16), subject])
+    else:
+        subject = subject[-offset:]
+    return reference, subject, -offset - 1
+
+
+# == Runs ==
+
+def _rss_mb():
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes; mac reports bytes
+    return rss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def run_case(case):
+    """Runs a single alignment benchmark case, returning a result dict."""
+    from . import align
+    reference, subject, expected = synthetic_pair(
+        case['samplerate'], case['duration'], case['shift_seconds'],
+        seed=case['seed'],
+    )
+    rss_before = _rss_mb()
+    tracemalloc.start()
+    start = time.perf_counter()
+    analysis = align.cross_correlate(reference, subject, case['samplerate'],
+                                     preprocess=case['preprocess'],
+                                     **case['options']).analysis
+    wall = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dict(
+        case,
+        expected_shift=expected,
+        shift=analysis['correlation_shift'],
+        error=analysis['correlation_shift'] - expected,
+        error_ms=1000 * (analysis['correlation_shift'] - expected) / case['samplerate'],
+        wall_seconds=wall,
+        tracemalloc_peak_mb=traced_peak / 2**20,
+        rss_before_mb=rss_before,
+        peak_rss_mb=_rss_mb(),
+    )
+
+
+def cases(args):
+    """Yields benchmark cases for every combination of the arguments."""
+    for options in args.options:
+        for preprocess in args.preprocess:
+            for samplerate in args.samplerate:
+                for trial in range(args.trials):
+                    yield {
+                        'preprocess': preprocess,
+                        'samplerate': samplerate,
+                        'options': options,
+                        'duration': args.duration,
+                        'shift_seconds': args.shift * (-1) ** trial,
+                        'seed': trial,
+                    }
+
+
+def benchmark_align(args):
+    # A new process per case, so that max RSS is only for that case
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, cases(args)):
+            print(json.dumps(result), flush=True)
+
+
+# == Encoding ==
+
+def synthetic_media(filename, duration=30, width=1280, height=720):
+    """Writes a test video with a tone, for encoding benchmarks."""
+    from . import ffmpeg
+    video = ffmpeg.input(f'testsrc2=size={width}x{height}:rate=30:duration={duration}',
+                         format='lavfi')
+    audio = ffmpeg.input(f'sine=frequency=440:sample_rate=48000:duration={duration}',
+                         format='lavfi')
+    (ffmpeg.encode.output(video, audio, filename,
+                          profile=ffmpeg.encode.get_profile(name='quality'))
+     .run(overwrite_output=True, quiet=True))
+
+
+def run_encode(filename, profile_name, height, out_dir, segments=1):
+    """Encodes a file like align_video does, returning a result dict.
+
+    With `segments` other than 1, encodes in parallel segments (see
+    `ffmpeg.segments`).
+    """
+    from . import ffmpeg
+    from . import procstats
+    probe = ffmpeg.probe(filename)
+    profile = ffmpeg.encode.get_profile(name=profile_name)
+    out_file = os.path.join(out_dir, f'{profile_name}.mp4')
+    if probe.video and segments != 1:
+        def encode():
+            ffmpeg.segments.encode_segmented(
+                filename, out_file, {'pad_seconds': 0, 'trim_seconds': 0}, profile,
+                probe.duration, segments=segments or None, framerate=30,
+                video_filter=lambda v: v.scale(w=-2, h=height))
+    else:
+        stream = ffmpeg.input(filename)
+        streams = [stream.audio]
+        if probe.video:
+            streams.append(stream.video.scale(w=-2, h=height))
+        output = ffmpeg.encode.output(*streams, out_file, profile=profile,
+                                      video=bool(probe.video),
+                                      r=30, ac=1, movflags='+faststart')
+
+        def encode():
+            output.run(overwrite_output=True, quiet=True)
+
+    records = procstats.add_sink(procstats.Aggregator(keep_records=True))
+    try:
+        start = time.perf_counter()
+        encode()
+        wall = time.perf_counter() - start
+    finally:
+        procstats.remove_sink(records)
+    # Processes run by the asyncio runner have no cpu time
+    cpu = [r.cpu_seconds for r in records.records if r.cpu_seconds is not None]
+    size = os.path.getsize(out_file)
+    return {
+        'input': filename,
+        'profile': profile_name,
+        'height': height,
+        'segments': segments,
+        'duration_seconds': probe.duration,
+        'wall_seconds': wall,
+        'cpu_seconds': sum(cpu) if len(cpu) == len(records.records) else None,
+        'max_rss_mb': max(r.max_rss_mb or 0 for r in records.records),
+        'speed': probe.duration / wall,
+        'output_bytes': size,
+        'bitrate_kbps': 8 * size / 1000 / probe.duration,
+    }
+
+
+def benchmark_encode(args):
+    with tempfile.TemporaryDirectory() as tempdir:
+        inputs = args.input
+        if not inputs:
+            inputs = [os.path.join(tempdir, 'synthetic.mp4')]
+            synthetic_media(inputs[0], args.duration)
+        for filename in inputs:
+            for profile_name in args.profile:
+                for segments in args.segments:
+                    for _ in range(args.trials):
+                        result = run_encode(filename, profile_name, args.height,
+                                            tempdir, segments)
+                        print(json.dumps(result), flush=True)
+
+
+# == Cli ==
+
+def parser():
+    from .align import PREPROCESSORS
+    from .ffmpeg.encode import PROFILES
+    p = argparse.ArgumentParser(prog='python -m quarantine_chorus.benchmark',
+                                description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = p.add_subparsers(dest='command', required=True)
+
+    a = commands.add_parser('align', help='benchmark audio alignment')
+    a.add_argument('--preprocess', nargs='+',
+                   default=list(PREPROCESSORS) + ['rms_200', 'onset_100'],
+                   help='preprocess algorithms (default: all)')
+    a.add_argument('--samplerate', nargs='+', type=int,
+                   default=[8000, 16000, 24000, 48000])
+    a.add_argument('--options', nargs='+', type=json.loads, default=[{}],
+                   help='JSON objects of extra cross_correlate kwargs, e.g. '
+                        '\'{"dtype": "float32", "coarse_samplerate": 1000}\'')
+    a.add_argument('--duration', type=float, default=120,
+                   help='seconds of synthetic audio')
+    a.add_argument('--shift', type=float, default=1.5,
+                   help='seconds to shift the subject (alternates sign per trial)')
+    a.add_argument('--trials', type=int, default=2)
+    a.set_defaults(func=benchmark_align)
+
+    e = commands.add_parser('encode', help='benchmark aligned video encode profiles')
+    e.add_argument('--input', nargs='+', default=[],
+                   help='media files to encode (default: a synthetic test video)')
+    e.add_argument('--profile', nargs='+', default=list(PROFILES),
+                   help='encode profiles (default: all built-in profiles)')
+    e.add_argument('--height', type=int, default=360,
+                   help='output video height')
+    e.add_argument('--duration', type=float, default=30,
+                   help='seconds of synthetic video')
+    e.add_argument('--segments', nargs='+', type=int, default=[1],
+                   help='parallel segments (1: one process, 0: one per cpu)')
+    e.add_argument('--trials', type=int, default=1)
+    e.set_defaults(func=benchmark_encode)
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
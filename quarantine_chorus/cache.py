@@ -0,0 +1,197 @@
+"""Content-addressed caches.
+
+Stores map string keys to bytes, and may evict entries by age or total size. Keys
+are usually built from content hashes (see `hash_file` and `hash_array`) plus the
+parameters used to compute the cached value (see `hash_params`).
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def hash_file(filename, chunk_size=1024 * 1024):
+    """Returns the sha256 hex digest of a file's contents."""
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_array(array):
+    """Returns the sha256 hex digest of a numpy array's contents, shape and dtype."""
+    import numpy as np
+    sha = hashlib.sha256(f'{array.dtype.str}{array.shape}'.encode('utf-8'))
+    sha.update(np.ascontiguousarray(array).data)
+    return sha.hexdigest()
+
+
+def hash_params(*args, **kwargs):
+    """Returns the sha256 hex digest of some JSON-serializable parameters."""
+    data = json.dumps([args, kwargs], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class LocalStore:
+    """A cache in a local directory.
+
+    Entries are evicted least recently used first once the total size goes over
+    `max_size` bytes, and once they are older than `max_age` seconds.
+    """
+    def __init__(self, path, max_size=None, max_age=None):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def _file(self, key):
+        return self.path.joinpath(key)
+
+    def get(self, key):
+        """Returns the bytes stored for `key`, or None."""
+        f = self._file(key)
+        try:
+            data = f.read_bytes()
+            # mtime doubles as last access time for LRU eviction
+            os.utime(f)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def get_path(self, key):
+        """Returns the path of the file stored for `key` (e.g. to mmap it), or None."""
+        f = self._file(key)
+        try:
+            os.utime(f)
+        except FileNotFoundError:
+            return None
+        return f
+
+    def set(self, key, data):
+        """Stores bytes for `key`."""
+        with self.writer(key) as f:
+            f.write(data)
+
+    @contextmanager
+    def writer(self, key):
+        """Returns a context manager with a binary file to write the entry for `key`.
+
+        The entry only appears once the context exits without an exception.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        f = self._file(key)
+        # Unique per writer, so that concurrent writers don't clobber each other
+        tmp = f.with_name(f'{f.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+        try:
+            with open(tmp, 'wb') as out:
+                yield out
+            tmp.replace(f)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self.evict()
+
+    def entries(self):
+        """Returns a list of (path, size, mtime), least recently used first."""
+        entries = []
+        for f in self.path.glob('*'):
+            try:
+                stat = f.stat()
+            except FileNotFoundError:
+                continue
+            if f.is_file() and not f.name.endswith('.tmp'):
+                entries.append((f, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self):
+        """Removes entries over the age or size limits."""
+        if self.max_size is None and self.max_age is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        for f, size, mtime in entries:
+            too_big = self.max_size is not None and total > self.max_size
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            if not (too_big or too_old):
+                continue
+            logging.info("Evicting cache entry %s", f)
+            try:
+                f.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # e.g. memory-mapped on windows; try again next time
+                logging.warning("Unable to evict cache entry %s", f, exc_info=True)
+                continue
+            total -= size
+
+
+class GCSStore:
+    """A cache in a cloud storage bucket, under `prefix`.
+
+    Works with the gcp_shim local storage too. Eviction is the same as LocalStore,
+    except that entries are evicted oldest first (cloud storage doesn't track access
+    times).
+    """
+    def __init__(self, storage_client, bucket, prefix='',
+                 max_size=None, max_age=None):
+        self.storage_client = storage_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_size = max_size
+        self.max_age = max_age
+
+    def _gcs(self, key):
+        from .submission import _GCS
+        return _GCS(self.storage_client, self.bucket, self.prefix + key)
+
+    def get(self, key):
+        """Returns the bytes stored for `key`, or None."""
+        gcs = self._gcs(key)
+        if not gcs.exists():
+            return None
+        return gcs.download_bytes()
+
+    def set(self, key, data):
+        """Stores bytes for `key`."""
+        self._gcs(key).upload_bytes(data)
+        self.evict()
+
+    def evict(self):
+        """Removes entries over the age or size limits."""
+        if self.max_size is None and self.max_age is None:
+            return
+        bucket = self.storage_client.bucket(self.bucket)
+        entries = sorted(((b, b.size, b.updated)
+                          for b in bucket.list_blobs(prefix=self.prefix)),
+                         key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for blob, size, updated in entries:
+            too_big = self.max_size is not None and total > self.max_size
+            too_old = (self.max_age is not None
+                       and (now - updated).total_seconds() > self.max_age)
+            if not (too_big or too_old):
+                continue
+            logging.info("Evicting cache entry %s", blob.name)
+            blob.delete()
+            total -= size
+
+
+def get_json(store, key):
+    """Returns the JSON value stored for `key`, or None."""
+    data = store.get(key)
+    if data is not None:
+        return json.loads(data.decode('utf-8'))
+
+
+def set_json(store, key, value):
+    """Stores a JSON-serializable value for `key`."""
+    store.set(key, json.dumps(value).encode('utf-8'))
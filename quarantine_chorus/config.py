@@ -12,6 +12,7 @@ UPLOAD_BUCKET = CONFIG['gcs']['bucket']['video_upload']
 AUDIO_EXTRACTED_BUCKET = CONFIG['gcs']['bucket']['audio_extracted']
 AUDIO_ALIGNED_BUCKET = CONFIG['gcs']['bucket']['audio_aligned']
 VIDEO_ALIGNED_BUCKET = CONFIG['gcs']['bucket']['video_aligned']
+CACHE_BUCKET = CONFIG['gcs']['bucket']['cache']
 SUBMISSIONS_COLLECTION = CONFIG['gcs']['collection']['submissions']
 
 
@@ -8,6 +8,8 @@ from ffmpeg import *  # noqa F403
 # For patching run_async
 import ffmpeg._run
 
+from .. import procstats
+
 # extra filters
 from ffmpeg.nodes import filter_operator, output_operator
 from . import filters as extra_filters
@@ -15,21 +17,40 @@ from .filters import *  # noqa F403
 
 # Loudnorm filters
 from .loudnorm import run_analysis as run_loudnorm_analysis  # noqa F401
+from .loudnorm import analysis_filter as loudnorm_analysis_filter  # noqa F401
+from .loudnorm import parse_analysis as parse_loudnorm_analysis  # noqa F401
+from .loudnorm import params as loudnorm_params  # noqa F401
 from .loudnorm import loudnorm
 
 # Crop filters
 from .crop import run_cropdetect  # noqa F401
 from .crop import crop
 
+# Encode profiles
+from . import encode  # noqa F401
+from . import plan  # noqa F401
+
+# Segment-parallel encoding
+from . import segments  # noqa F401
+
+# Media analysis
+from .analyze import analyze_media  # noqa F401
+
 # ffprobe helpers
 from . import _probe
-from ._probe import probe  # noqa F401
+from ._probe import ProbeResult, probe, probe_many, set_probe_cache  # noqa F401
+from ._probe import keyframe_times  # noqa F401
 
 # ffplay helpers
 from . import _play
 from ._play import play, play_async  # noqa F401
 
 
+# asyncio runner
+from . import _aio  # noqa F401
+from ._aio import Progress, Runner, run_all  # noqa F401
+
+
 # == Patch run_async with logging and allow changing default ffmpeg ==
 
 EXECUTABLE = 'ffmpeg'
@@ -61,7 +82,7 @@ def run_async(
     stdin_stream = subprocess.PIPE if pipe_stdin else None
     stdout_stream = subprocess.PIPE if pipe_stdout or quiet else None
     stderr_stream = subprocess.PIPE if pipe_stderr or quiet else None
-    return subprocess.Popen(
+    return procstats.Popen(  # changed, for resource accounting
         args, stdin=stdin_stream, stdout=stdout_stream, stderr=stderr_stream
     )
 
@@ -0,0 +1,365 @@
+"""asyncio ffmpeg runner, with a concurrency limit and progress events.
+
+Where asyncio can't run subprocesses (off the main thread before Python 3.8),
+`run_all` runs jobs in threads instead.
+"""
+
+import asyncio
+import concurrent.futures
+import dataclasses as dc
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+
+import ffmpeg
+import ffmpeg._run
+
+from .. import procstats
+
+
+# Keys ffmpeg writes with -progress. Progress goes to stderr along with the log, so
+# only lines with these keys are parsed as progress.
+PROGRESS_KEYS = {
+    'frame', 'fps', 'bitrate', 'total_size', 'out_time_us', 'out_time_ms',
+    'out_time', 'dup_frames', 'drop_frames', 'speed', 'progress',
+}
+
+
+@dc.dataclass
+class Progress:
+    """One -progress report from ffmpeg. `done` is set on the last one."""
+    out_time: float = 0.0
+    speed: Optional[float] = None
+    fps: Optional[float] = None
+    frame: Optional[int] = None
+    total_size: Optional[int] = None
+    done: bool = False
+
+    @classmethod
+    def from_dict(cls, d):
+        def number(k, type_=float):
+            try:
+                return type_(d[k].rstrip('x'))
+            except (KeyError, ValueError):
+                return None
+
+        # out_time_ms is actually microseconds too (an old ffmpeg bug kept for
+        # compatibility)
+        us = number('out_time_us', int)
+        if us is None:
+            us = number('out_time_ms', int)
+        if us is None and d.get('out_time'):
+            h, m, s = d['out_time'].split(':')
+            us = int((int(h) * 3600 + int(m) * 60 + float(s)) * 1e6)
+        return cls(
+            out_time=max(us or 0, 0) / 1e6,
+            speed=number('speed'),
+            fps=number('fps'),
+            frame=number('frame', int),
+            total_size=number('total_size', int),
+            done=d.get('progress') == 'end',
+        )
+
+
+class _ProgressParser:
+    """Splits ffmpeg's stderr into log output and Progress reports."""
+    def __init__(self, on_progress=None):
+        self.on_progress = on_progress
+        self.stderr = bytearray()
+        self._line = bytearray()
+        self._report = {}
+
+    def feed(self, data):
+        lines = (self._line + data).split(b'\n')
+        self._line = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self):
+        if self._line:
+            self._parse_line(self._line)
+            self._line = bytearray()
+
+    def _parse_line(self, line):
+        key, sep, value = line.rstrip(b'\r').partition(b'=')
+        key = key.decode(errors='replace')
+        if not sep or key not in PROGRESS_KEYS and not key.startswith('stream_'):
+            self.stderr += line + b'\n'
+            return
+        self._report[key] = value.decode(errors='replace').strip()
+        # Each report ends with a progress line
+        if key == 'progress':
+            progress = Progress.from_dict(self._report)
+            self._report = {}
+            if self.on_progress is not None:
+                self.on_progress(progress)
+
+
+async def _read_stream(stream, callback):
+    while True:
+        data = await stream.read(2**16)
+        if not data:
+            return
+        callback(data)
+
+
+def _read_file(f, callback):
+    for data in iter(lambda: f.read1(2**16), b''):
+        callback(data)
+
+
+def _write_file(f, input):
+    try:
+        f.write(input)
+    except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg stopped reading; its exit code says why
+        pass
+    finally:
+        try:
+            f.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def can_run_async():
+    """Returns True if asyncio can run subprocesses in this thread.
+
+    Before Python 3.8, POSIX event loops can only wait for child processes in the
+    main thread (the child watcher needs a SIGCHLD handler).
+    """
+    return (sys.platform == 'win32' or sys.version_info >= (3, 8)
+            or threading.current_thread() is threading.main_thread())
+
+
+def _new_event_loop():
+    if sys.platform == 'win32':
+        # Only the proactor loop runs subprocesses (not the default before 3.8)
+        return asyncio.ProactorEventLoop()
+    return asyncio.new_event_loop()
+
+
+def _run_coroutine(coro):
+    """Like asyncio.run, with an event loop that can run subprocesses."""
+    loop = _new_event_loop()
+    try:
+        # Also attaches the child watcher to the loop on POSIX
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class Runner:
+    """Runs ffmpeg stream specs as asyncio subprocesses, `max_jobs` at a time.
+
+    Jobs past the limit wait their turn (first come, first served). Cancelling a
+    job kills its ffmpeg process.
+
+        runner = Runner(max_jobs=2)
+        await asyncio.gather(*(runner.run(spec) for spec in specs))
+
+    `run_sync` runs a job in the calling thread instead, for where asyncio can't
+    run subprocesses (see `can_run_async`); `kill` stops those jobs.
+    """
+    def __init__(self, max_jobs=None, cmd=None):
+        self.max_jobs = max_jobs or os.cpu_count() or 1
+        self.cmd = cmd
+        # Created on first use, so that it belongs to the running event loop
+        self._semaphore = None
+        # Processes of run_sync jobs
+        self._procs = set()
+        self._procs_lock = threading.Lock()
+        self._killed = False
+
+    def _compile(self, stream_spec, overwrite_output):
+        from . import EXECUTABLE
+        args = ffmpeg._run.compile(stream_spec, self.cmd or EXECUTABLE,
+                                   overwrite_output=overwrite_output)
+        # After the executable, which may be more than one arg
+        n = len(self.cmd) if isinstance(self.cmd, (list, tuple)) else 1
+        args[n:n] = ['-nostats', '-progress', 'pipe:2']
+        return args
+
+    async def run(self, stream_spec, on_progress=None, input=None,
+                  capture_stdout=False, overwrite_output=True):
+        """Runs a stream spec, returning (stdout, stderr).
+
+        `on_progress` is called with a Progress for each progress report. stderr
+        is ffmpeg's log output, without the progress reports. `input` is bytes to
+        write to stdin. Raises `ffmpeg.Error` if ffmpeg fails.
+        """
+        args = self._compile(stream_spec, overwrite_output)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        async with self._semaphore:
+            return await self._run(args, on_progress, input, capture_stdout)
+
+    async def _run(self, args, on_progress, input, capture_stdout):
+        logging.info('Running ffmpeg with args: %s', args)
+        start = time.perf_counter()
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if input is not None else None,
+            stdout=asyncio.subprocess.PIPE if capture_stdout else None,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        parser = _ProgressParser(on_progress)
+        stdout = bytearray()
+        tasks = [_read_stream(proc.stderr, parser.feed)]
+        if capture_stdout:
+            tasks.append(_read_stream(proc.stdout, stdout.extend))
+        if input is not None:
+            tasks.append(self._write_input(proc, input))
+        try:
+            await asyncio.gather(*tasks)
+            returncode = await proc.wait()
+        except BaseException:
+            # Includes cancellation: don't leave ffmpeg running
+            if proc.returncode is None:
+                logging.info('Killing ffmpeg (pid %d)', proc.pid)
+                proc.kill()
+                await proc.wait()
+            raise
+        finally:
+            # asyncio reaps the process itself, so there's no rusage
+            procstats.record(args, proc.returncode, time.perf_counter() - start)
+        parser.close()
+        stdout = bytes(stdout) if capture_stdout else None
+        stderr = bytes(parser.stderr)
+        if returncode:
+            raise ffmpeg.Error('ffmpeg', stdout, stderr)
+        return stdout, stderr
+
+    def run_sync(self, stream_spec, on_progress=None, input=None,
+                 capture_stdout=False, overwrite_output=True):
+        """Same as `run`, but blocks the calling thread.
+
+        Doesn't limit the number of jobs; run it in a pool of `max_jobs` threads.
+        """
+        args = self._compile(stream_spec, overwrite_output)
+        logging.info('Running ffmpeg with args: %s', args)
+        proc = procstats.Popen(
+            args,
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE if capture_stdout else None,
+            stderr=subprocess.PIPE,
+        )
+        with self._procs_lock:
+            self._procs.add(proc)
+            if self._killed:
+                proc.kill()
+        parser = _ProgressParser(on_progress)
+        stdout = bytearray()
+        threads = []
+        if capture_stdout:
+            threads.append(threading.Thread(target=_read_file,
+                                            args=(proc.stdout, stdout.extend)))
+        if input is not None:
+            threads.append(threading.Thread(target=_write_file,
+                                            args=(proc.stdin, input)))
+        try:
+            for t in threads:
+                t.start()
+            _read_file(proc.stderr, parser.feed)
+            for t in threads:
+                t.join()
+            returncode = proc.wait()
+        except BaseException:
+            if proc.poll() is None:
+                logging.info('Killing ffmpeg (pid %d)', proc.pid)
+                proc.kill()
+                proc.wait()
+            raise
+        finally:
+            with self._procs_lock:
+                self._procs.discard(proc)
+            for f in (proc.stdout, proc.stderr):
+                if f is not None:
+                    f.close()
+        parser.close()
+        stdout = bytes(stdout) if capture_stdout else None
+        stderr = bytes(parser.stderr)
+        if returncode:
+            raise ffmpeg.Error('ffmpeg', stdout, stderr)
+        return stdout, stderr
+
+    def kill(self):
+        """Kills the processes of running `run_sync` jobs, and any started later."""
+        with self._procs_lock:
+            self._killed = True
+            for proc in self._procs:
+                if proc.poll() is None:
+                    logging.info('Killing ffmpeg (pid %d)', proc.pid)
+                    proc.kill()
+
+    @staticmethod
+    async def _write_input(proc, input):
+        try:
+            proc.stdin.write(input)
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg stopped reading; its exit code says why
+            pass
+        finally:
+            proc.stdin.close()
+
+
+def run_all(stream_specs, max_jobs=None, on_progress=None, cmd=None, **kwargs):
+    """Runs stream specs concurrently, returning a list of (stdout, stderr).
+
+    A blocking wrapper around `Runner` for code that isn't async; works from any
+    thread. `on_progress` is called with (index, Progress). Stops (killing the
+    rest) at the first error.
+    """
+    runner = Runner(max_jobs, cmd)
+
+    def progress(i):
+        return (lambda p: on_progress(i, p)) if on_progress else None
+
+    if not can_run_async():
+        return _run_all_threads(runner, stream_specs, progress, **kwargs)
+
+    async def run():
+        tasks = [
+            asyncio.ensure_future(runner.run(spec, on_progress=progress(i), **kwargs))
+            for i, spec in enumerate(stream_specs)
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # Wait for the kills
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    return _run_coroutine(run())
+
+
+def _run_all_threads(runner, stream_specs, progress, **kwargs):
+    """run_all with a thread per job (`runner.max_jobs` at a time)."""
+    with concurrent.futures.ThreadPoolExecutor(runner.max_jobs) as executor:
+        futures = [executor.submit(runner.run_sync, spec, on_progress=progress(i),
+                                   **kwargs)
+                   for i, spec in enumerate(stream_specs)]
+        try:
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+            # Raise the first error before waiting on the rest
+            for f in futures:
+                if f in done and f.exception() is not None:
+                    f.result()
+            return [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            runner.kill()
+            raise
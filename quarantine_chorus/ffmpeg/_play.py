@@ -5,6 +5,8 @@ import subprocess
 
 import ffmpeg
 
+from .. import procstats
+
 
 EXECUTABLE = 'ffplay'
 
@@ -28,7 +30,7 @@ def play_async(
     stdout_stream = subprocess.PIPE if pipe_stdout or quiet else None
     stderr_stream = subprocess.PIPE if pipe_stderr or quiet else None
     logging.info('Running ffplay with args: %s', args)
-    return subprocess.Popen(
+    return procstats.Popen(
         args, stdin=stdin_stream, stdout=stdout_stream, stderr=stderr_stream
     )
 
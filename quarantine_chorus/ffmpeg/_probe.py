@@ -1,8 +1,19 @@
 """ffprobe helpers."""
 
+import json
+import logging
+import os
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import ffmpeg
+import ffmpeg._utils
 import funcy as F
 
+from .. import procstats
+
 
 EXECUTABLE = 'ffprobe'
 
@@ -59,8 +70,160 @@ class ProbeResult:
     def duration(self):
         return max(float(m.get('duration', 0)) for m in self.maps)
 
+    def to_dict(self):
+        """Returns a JSON-serializable dict (see `from_dict`)."""
+        return {'filename': self.filename, 'probe': self._probe}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['filename'], d['probe'])
+
+
+def _run_ffprobe(filename, cmd, **kwargs):
+    """Same as ffmpeg.probe, with resource accounting."""
+    args = [cmd, '-show_format', '-show_streams', '-of', 'json']
+    args += ffmpeg._utils.convert_kwargs_to_cmd_line_args(kwargs)
+    args += [filename]
+    proc = procstats.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise ffmpeg.Error('ffprobe', out, err)
+    return json.loads(out.decode('utf-8'))
+
+
+def keyframe_times(filename, cmd=None):
+    """Returns the times (seconds) of the keyframes of the first video stream.
+
+    Only packet headers are read; nothing is decoded.
+    """
+    args = [cmd or EXECUTABLE, '-v', 'error', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags', '-of', 'csv=print_section=0',
+            filename]
+    proc = procstats.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        raise ffmpeg.Error('ffprobe', out, err)
+    times = []
+    for line in out.decode('utf-8').splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    return sorted(times)
+
+
+# == Cache ==
+
+class ProbeCache:
+    """Caches ffprobe output, in memory and optionally in a directory.
+
+    Keeps the `max_entries` most recently used results in memory. With a `path`,
+    results are also saved there as JSON (see `cache.LocalStore`), so they last
+    between runs.
+    """
+    def __init__(self, path=None, max_entries=256, max_size=None):
+        from ..cache import LocalStore
+        self.max_entries = max_entries
+        self.store = LocalStore(path, max_size) if path else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached probe dict for `key`, or None."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        if self.store is not None:
+            from ..cache import get_json
+            d = get_json(self.store, key + '.json')
+            if d is not None:
+                self._remember(key, d)
+                return d
+        return None
+
+    def set(self, key, d):
+        self._remember(key, d)
+        if self.store is not None:
+            from ..cache import set_json
+            set_json(self.store, key + '.json', d)
+
+    def _remember(self, key, d):
+        with self._lock:
+            self._memory[key] = d
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
 
-def probe(filename, cmd=None, **kwargs):
-    res = ffmpeg.probe(filename, cmd or EXECUTABLE, **kwargs)
+
+# See `set_probe_cache`
+_cache = ProbeCache()
+
+
+def set_probe_cache(path=None, max_entries=256, max_size=None):
+    """Sets up the probe cache (in memory only without a `path`).
+
+    `max_entries=0` turns the cache off.
+    """
+    global _cache
+    _cache = ProbeCache(path, max_entries, max_size) if max_entries else None
+
+
+def cache_key(filename, version=None, **kwargs):
+    """Returns the probe cache key for a file, or None if it can't be cached.
+
+    `version` identifies the contents for files that aren't local, e.g. the url
+    and generation of a cloud storage object. Otherwise local files are keyed by
+    path, size and modification time.
+    """
+    from ..cache import hash_params
+    if version is None:
+        try:
+            stat = os.stat(filename)
+        except (OSError, ValueError):
+            return None
+        version = [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+    return 'probe-' + hash_params(version, **kwargs)
+
+
+# == Probing ==
+
+def probe(filename, cmd=None, version=None, **kwargs):
+    """Runs ffprobe on a file, returning a ProbeResult.
+
+    Results are cached (see `set_probe_cache` and `cache_key`).
+    """
+    key = cache_key(filename, version, **kwargs) if _cache is not None else None
+    if key is not None:
+        d = _cache.get(key)
+        if d is not None:
+            return ProbeResult(filename, d)
+    res = _run_ffprobe(filename, cmd or EXECUTABLE, **kwargs)
+    if key is not None and res:
+        _cache.set(key, res)
     if res:
         return ProbeResult(filename, res)
+
+
+def probe_many(filenames, cmd=None, max_workers=None, return_exceptions=False,
+               **kwargs):
+    """Probes several files, returning a list of ProbeResults in the same order.
+
+    Files that aren't cached are probed concurrently, `max_workers` at a time.
+    Raises the first error, unless `return_exceptions` is set, in which case
+    errors are returned in place of their results.
+    """
+    def probe_one(filename):
+        try:
+            return probe(filename, cmd, **kwargs)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    filenames = list(filenames)
+    if not filenames:
+        return []
+    max_workers = max_workers or min(len(filenames), os.cpu_count() or 1)
+    logging.info("Probing %d files", len(filenames))
+    with ThreadPoolExecutor(max_workers) as pool:
+        return list(pool.map(probe_one, filenames))
@@ -0,0 +1,92 @@
+"""Single-pass media analysis: crop, loudness and leading silence."""
+
+import re
+
+import ffmpeg
+
+from .crop import cropdetect_outputs, parse_cropdetect
+
+
+# Quieter than this counts as silence
+SILENCE_NOISE = '-50dB'
+# Minimum length of silence to report, in seconds
+SILENCE_DURATION = 0.1
+
+
+def parse_ebur128_summary(lines):
+    """Parses the summary ebur128 prints at the end into a dict (or None)."""
+    summary = None
+    patterns = {
+        'i': r'^I:\s*(\S+) LUFS',
+        'lra': r'^LRA:\s*(\S+) LU',
+        'tp': r'^Peak:\s*(\S+) dBFS',
+    }
+    for line in lines:
+        if 'Summary:' in line:
+            summary = {}
+        elif summary is not None:
+            for k, pattern in patterns.items():
+                m = re.search(pattern, line.strip())
+                if m and k not in summary:
+                    summary[k] = float(m.group(1))
+    return summary
+
+
+def parse_leading_silence(lines, duration):
+    """Returns the seconds of silence at the start, from silencedetect output."""
+    text = '\n'.join(lines)
+    starts = [float(x) for x in re.findall(r'silence_start: (\S+)', text)]
+    ends = [float(x) for x in re.findall(r'silence_end: (\S+)', text)]
+    if not starts or starts[0] > SILENCE_DURATION:
+        return 0.0
+    # Silence that lasts to the end of the file has no end
+    return ends[0] if ends else duration
+
+
+def analyze_media(filename, cmd=None, probe=None, crop_samples=5, audio=True):
+    """Analyzes a media file with one ffprobe and one ffmpeg run.
+
+    Returns a JSON-serializable dict of:
+
+    probe           -- ffprobe output (see `ProbeResult.to_dict`)
+    crop            -- consensus crop rectangle of keyframes at `crop_samples`
+                       points (see `crop.cropdetect_outputs`), or None if there's
+                       no video
+    loudness        -- integrated loudness (i), loudness range (lra) and true peak
+                       (tp) from ebur128, or None if there's no audio (or `audio`
+                       is False)
+    leading_silence -- seconds of silence before the audio starts (0 if `audio` is
+                       False)
+
+    Only a few keyframes of video are decoded, however long the file is; all of the
+    audio is decoded, unless `audio` is False. Pass a ProbeResult as `probe` if
+    there is one already.
+    """
+    from . import probe as run_probe
+    probe = probe or run_probe(filename)
+    outputs = []
+    audio = audio and probe.audio
+    if audio:
+        outputs.append(ffmpeg.input(filename).audio
+                       .filter('silencedetect', n=SILENCE_NOISE, d=SILENCE_DURATION)
+                       .filter('ebur128', peak='true', framelog='verbose')
+                       .output('-', f='null'))
+    if probe.video:
+        # More inputs of the same file, seeking to each sample point
+        outputs.extend(cropdetect_outputs(filename, probe.duration, crop_samples))
+    result = {
+        'probe': probe.to_dict(),
+        'crop': None,
+        'loudness': None,
+        'leading_silence': 0.0,
+    }
+    if not outputs:
+        return result
+    _, stderr = ffmpeg.merge_outputs(*outputs).run(cmd=cmd, capture_stderr=True)
+    lines = stderr.decode('utf-8', errors='replace').splitlines()
+    if probe.video:
+        result['crop'] = parse_cropdetect(lines)
+    if audio:
+        result['loudness'] = parse_ebur128_summary(lines)
+        result['leading_silence'] = parse_leading_silence(lines, probe.duration)
+    return result
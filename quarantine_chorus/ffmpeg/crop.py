@@ -1,5 +1,6 @@
 """Crop detection filter."""
 
+import collections
 import re
 
 import ffmpeg
@@ -12,18 +13,76 @@ def read_cropdetect_line(l):
         return m.groupdict()
 
 
-def run_cropdetect(filename, cmd=None, **input_args):
-    """Runs the crepdetect filter for a file. Returns output as a dict.
+def consensus_crop(rects):
+    """Returns the most common crop rectangle (None for no rectangles).
 
-    Runs crop detection only on a single frame. To select the frame to use, pass `ss`
-    with the start position in seconds.
+    Per-frame crops vary with what's on screen (dark scenes crop more), and intros
+    can be letterboxed, so the most common rectangle beats the first or the union.
     """
-    stream = (ffmpeg
-              .input(filename, t=1, **input_args)
-              .video.filter('cropdetect', round=2))
-    # Cropdetect outputs a line per frame
-    _, stderr = stream.output('-', f='null').run(cmd=cmd, capture_stderr=True)
-    return F.first(F.keep(read_cropdetect_line, stderr.decode('utf-8').splitlines()))
+    counts = collections.Counter(tuple(sorted(r.items())) for r in rects if r)
+    if counts:
+        return dict(counts.most_common(1)[0][0])
+
+
+# Keyframes decoded at each sample point. Newer ffmpeg's cropdetect skips the first
+# two frames it sees, so the third is the one that counts.
+FRAMES_PER_SAMPLE = 3
+
+
+def sample_times(duration, samples=5):
+    """Returns `samples` evenly spaced times (seconds) over `duration` seconds.
+
+    Without a duration (not every file has one), returns just the start.
+    """
+    if not duration or duration <= 0:
+        return [0.0]
+    return [duration * (k + 0.5) / samples for k in range(samples)]
+
+
+def cropdetect_outputs(filename, duration, samples=5, **input_args):
+    """Returns ffmpeg outputs that run crop detection on keyframes.
+
+    Seeks to `samples` evenly spaced points over `duration` seconds (see
+    `sample_times`), and decodes only a few keyframes at each. Pass `ss` to detect
+    at that one point instead. Run them (they can be merged with other outputs)
+    and pass the stderr lines to `parse_cropdetect`.
+    """
+    if 'ss' in input_args:
+        times = [input_args.pop('ss')]
+    else:
+        times = sample_times(duration, samples)
+    outputs = []
+    for ss in times:
+        outputs.append(ffmpeg
+                       .input(filename, ss=ss, **{'skip_frame:v': 'nokey'},
+                              **input_args)
+                       .video
+                       # Reset every frame, so each line is that keyframe's crop
+                       .filter('cropdetect', round=2, reset=1)
+                       .output('-', f='null', vframes=FRAMES_PER_SAMPLE))
+    return outputs
+
+
+def parse_cropdetect(lines):
+    """Returns the consensus crop rectangle from cropdetect output, or None."""
+    return consensus_crop(F.keep(read_cropdetect_line, lines))
+
+
+def run_cropdetect(filename, cmd=None, samples=5, duration=None, **input_args):
+    """Runs crop detection on keyframes spread across a file. Returns a dict.
+
+    Seeks to `samples` evenly spaced points (over `duration` seconds, probed if not
+    given) and decodes only a few keyframes at each, all in one ffmpeg run, so the
+    cost doesn't depend on the length of the file. With `ss`, only detects at that
+    point. Returns the consensus crop rectangle (see `consensus_crop`), or None if
+    nothing was detected.
+    """
+    if duration is None and 'ss' not in input_args:
+        from . import probe
+        duration = probe(filename).duration
+    outputs = cropdetect_outputs(filename, duration, samples, **input_args)
+    _, stderr = ffmpeg.merge_outputs(*outputs).run(cmd=cmd, capture_stderr=True)
+    return parse_cropdetect(stderr.decode('utf-8').splitlines())
 
 
 def crop(stream, **kwargs):
@@ -0,0 +1,113 @@
+"""Encode profiles: named sets of codec settings for video output.
+
+A profile is a dict with any of these keys:
+
+codec         -- video codec (e.g. libx264)
+preset        -- encoder speed/quality preset (e.g. veryfast)
+crf           -- constant rate factor (quality); or
+bitrate       -- target video bitrate (e.g. 1M)
+threads       -- encoder threads (0: ffmpeg picks)
+tune          -- encoder tuning (e.g. film, zerolatency)
+pix_fmt       -- pixel format (yuv420p plays everywhere)
+audio_codec   -- audio codec (e.g. aac)
+audio_bitrate -- audio bitrate (e.g. 128k)
+
+Built-in profiles are in PROFILES. The song config can change them or add more
+under `video.profiles`, and pick one with `video.profile` (see `get_profile`).
+"""
+
+import ffmpeg
+
+
+PROFILES = {
+    # Small, quick, and good enough for singers on a grid
+    'default': {
+        'codec': 'libx264',
+        'preset': 'veryfast',
+        'crf': 23,
+        'pix_fmt': 'yuv420p',
+        'audio_codec': 'aac',
+        'audio_bitrate': '128k',
+    },
+    # Fewest function-seconds
+    'fast': {
+        'codec': 'libx264',
+        'preset': 'ultrafast',
+        'crf': 26,
+        'pix_fmt': 'yuv420p',
+        'audio_codec': 'aac',
+        'audio_bitrate': '128k',
+    },
+    # For final renders
+    'quality': {
+        'codec': 'libx264',
+        'preset': 'slow',
+        'crf': 20,
+        'tune': 'film',
+        'pix_fmt': 'yuv420p',
+        'audio_codec': 'aac',
+        'audio_bitrate': '192k',
+    },
+    # Live previews, piped to ffplay as mpegts
+    'preview': {
+        'codec': 'libx264',
+        'preset': 'ultrafast',
+        'crf': 28,
+        'tune': 'zerolatency',
+        'pix_fmt': 'yuv420p',
+        'audio_codec': 'aac',
+        'audio_bitrate': '128k',
+    },
+}
+
+# Profile keys to ffmpeg-python output args
+_ARGS = {
+    'codec': 'vcodec',
+    'preset': 'preset',
+    'crf': 'crf',
+    'bitrate': 'video_bitrate',
+    'threads': 'threads',
+    'tune': 'tune',
+    'pix_fmt': 'pix_fmt',
+    'audio_codec': 'acodec',
+    'audio_bitrate': 'audio_bitrate',
+}
+
+
+def get_profile(video_cfg=None, name=None):
+    """Returns an encode profile by name.
+
+    `video_cfg` is a song's video config: profiles under its `profiles` key are
+    merged over the built-in ones, and `name` defaults to its `profile` key (or
+    'default'). Raises KeyError for unknown profiles.
+    """
+    video_cfg = video_cfg or {}
+    name = name or video_cfg.get('profile', 'default')
+    configured = video_cfg.get('profiles', {}).get(name)
+    if name not in PROFILES and configured is None:
+        raise KeyError(f"Unknown encode profile: {name}")
+    return {**PROFILES.get(name, {}), **(configured or {})}
+
+
+def profile_args(profile, video=True, audio=True):
+    """Converts an encode profile to ffmpeg output args.
+
+    Set `video` or `audio` to False when the output has no such stream.
+    """
+    args = {}
+    for k, v in profile.items():
+        if k not in _ARGS:
+            raise KeyError(f"Unknown encode profile setting: {k}")
+        is_audio = k.startswith('audio_')
+        if (audio if is_audio else video):
+            args[_ARGS[k]] = v
+    return args
+
+
+def output(*streams_and_filename, profile, video=True, audio=True, **kwargs):
+    """Like ffmpeg.output, with the codec settings of an encode profile.
+
+    kwargs override the profile's args.
+    """
+    return ffmpeg.output(*streams_and_filename,
+                         **{**profile_args(profile, video, audio), **kwargs})
@@ -1,29 +1,61 @@
 """Two-pass loudnorm filter."""
 
 import json
+import re
 
 import ffmpeg
 
 
+def params(cfg, singer_count=1):
+    """Returns the loudnorm params (i, tp, lra) for a song's loudnorm config.
+
+    Songs with more than one singer per submission can use different targets,
+    under `multiple_singers`.
+    """
+    return cfg if singer_count == 1 else cfg.get('multiple_singers', cfg)
+
+
+def analysis_filter(stream, params):
+    """Adds the loudnorm analysis (first pass) filter to an audio stream.
+
+    The results are printed to stderr when ffmpeg finishes; see `parse_analysis`.
+    """
+    return stream.filter('loudnorm',
+                         print_format='json',
+                         i=params['i'],
+                         tp=params['tp'],
+                         lra=params['lra'])
+
+
 def run_analysis(filename, params, cmd=None, **input_args):
     """Runs the loudnorm analysis pass for a file. Returns output as a dict.
 
     `params` should include i, tp, and lra.
     """
-    stream = (ffmpeg
-              .input(filename, **input_args)
-              .audio.filter('loudnorm',
-                            print_format='json',
-                            i=params['i'],
-                            tp=params['tp'],
-                            lra=params['lra']))
+    stream = analysis_filter(ffmpeg.input(filename, **input_args).audio, params)
     # ugh, loudnorm prints to stderr, and the script for automating two-pass
     # normalization (written by the loudnorm author!) just parses the last 12
-    # lines of output.
+    # lines of output. That breaks when anything logs after it, so parse_analysis
+    # looks for the JSON instead.
     # https://gist.github.com/kylophone/84ba07f6205895e65c9634a956bf6d54#file-loudness-rb-L29
     _, stderr = stream.output('-', f='null').run(cmd=cmd, capture_stderr=True)
-    json_str = '\n'.join(stderr.decode('utf-8').splitlines()[-12:])
-    d = json.loads(json_str)
+    return parse_analysis(stderr, params)
+
+
+def parse_analysis(stderr, params):
+    """Parses the output of an analysis pass from ffmpeg's stderr (bytes).
+
+    loudnorm prints its results as a JSON object after a `Parsed_loudnorm` line,
+    when the filter graph is freed. Other outputs of the same command (see
+    `analysis_filter`) can log after it, e.g. encoders when they close, so the
+    last JSON object after the marker is parsed, rather than the end of stderr.
+    """
+    text = stderr.decode('utf-8', errors='replace')
+    marker = text.rfind('[Parsed_loudnorm')
+    blocks = re.findall(r'\{[^{}]*\}', text[marker:]) if marker >= 0 else []
+    if not blocks:
+        raise ValueError("No loudnorm analysis in ffmpeg output")
+    d = json.loads(blocks[-1])
     # We need the input params for the second pass
     d.update(params)
     return d
@@ -0,0 +1,265 @@
+"""Encode planning: what an upload needs to match the song's video config.
+
+`plan_encode` compares an upload's ffprobe output and alignment against the video
+config, and decides for each stream whether it can be copied as is (COPY), copied
+with its timestamps shifted (SHIFT; the mp4 muxer writes an edit list), or has to
+be re-encoded (ENCODE). Filters that wouldn't change anything (scaling to the same
+size, resampling to the same rate) are left out of the plan, so uploads that
+already conform are remuxed instead of transcoded.
+"""
+
+import dataclasses as dc
+from fractions import Fraction
+from typing import List, Optional
+
+import ffmpeg
+
+from . import encode
+
+
+COPY = 'copy'
+SHIFT = 'shift'
+ENCODE = 'encode'
+
+# Copied streams are only shifted this much (seconds). Players that ignore edit
+# lists are off by no more than this.
+MAX_COPY_SHIFT = 0.05
+
+# Encoder names to the codec names ffprobe reports
+CODEC_NAMES = {
+    'libx264': 'h264',
+    'libx265': 'hevc',
+    'libvpx': 'vp8',
+    'libvpx-vp9': 'vp9',
+    'libaom-av1': 'av1',
+    'libfdk_aac': 'aac',
+    'libopus': 'opus',
+    'libmp3lame': 'mp3',
+}
+
+# Output channels of aligned video audio
+CHANNELS = 1
+
+
+@dc.dataclass
+class EncodePlan:
+    """How to make an aligned video; see `plan_encode`.
+
+    `video` and `audio` are COPY, SHIFT, ENCODE, or None if there's no such
+    stream. The filter fields are only set for re-encoded streams, and only if the
+    filter would change something. `reasons` says why streams are re-encoded.
+    """
+    video: Optional[str] = None
+    audio: Optional[str] = None
+    # Seconds to shift copied streams by (negative trims)
+    shift: float = 0.0
+    crop: Optional[dict] = None
+    resize: Optional[dict] = None
+    framerate: Optional[float] = None
+    samplerate: Optional[int] = None
+    loudnorm: Optional[dict] = None
+    reasons: List[str] = dc.field(default_factory=list)
+
+    @property
+    def remux_only(self):
+        """True if nothing is re-encoded."""
+        return ENCODE not in (self.video, self.audio)
+
+    def to_dict(self):
+        return dc.asdict(self)
+
+
+def _codec_name(encoder):
+    return CODEC_NAMES.get(encoder, encoder)
+
+
+def _frame_rate(s):
+    try:
+        rate = Fraction(s)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return float(rate) if rate else None
+
+
+def _is_constant_rate(video, framerate):
+    """True if the video is constant frame rate at `framerate`."""
+    r = _frame_rate(video.get('r_frame_rate'))
+    avg = _frame_rate(video.get('avg_frame_rate'))
+    return (r is not None and avg is not None
+            and abs(r - framerate) < 0.01 and abs(avg - framerate) < 0.01)
+
+
+def _scale_is_noop(resize, width, height):
+    """True if scaling (width, height) with `resize` (see `filters.scale`) keeps
+    the same size.
+
+    A negative size keeps the aspect ratio, rounded to a multiple of that number.
+    """
+    w = resize.get('width', resize.get('w'))
+    h = resize.get('height', resize.get('h'))
+    if not width or not height or (not w and not h):
+        return False
+
+    def same(target, actual):
+        if not target:
+            return True
+        if target < 0:
+            return actual % -target == 0
+        return target == actual
+
+    # With both negative, ffmpeg scales nothing
+    return same(w, width) and same(h, height) and not (w and w < 0 and h and h < 0)
+
+
+def _crop_rect(crop, width, height):
+    """Returns `crop` with int values, or None if it's the whole frame.
+
+    cropdetect always finds a rectangle (as strings); for video with nothing to
+    crop, it's the whole frame.
+    """
+    if not crop:
+        return None
+    crop = {k: int(v) for k, v in crop.items()}
+    whole = {'w': width, 'h': height, 'x': 0, 'y': 0}
+    if all(crop.get(k, v) == v for k, v in whole.items()):
+        return None
+    return crop
+
+
+def _alignment_shift(analysis):
+    if analysis['pad_seconds'] > 0:
+        return analysis['pad_seconds']
+    if analysis['trim_seconds'] > 0:
+        return -analysis['trim_seconds']
+    return 0.0
+
+
+def plan_encode(probe, analysis, cfg, crop=None, profile=None):
+    """Plans the encode of an aligned video.
+
+    `probe` is the upload's ProbeResult, `analysis` the alignment analysis (with
+    'pad_seconds', 'trim_seconds' and optionally 'loudnorm'), `cfg` the song's
+    video config, `crop` the detected crop rectangle, and `profile` the encode
+    profile (see `encode.get_profile`). Streams are only copied if
+    `cfg['stream_copy']` is set (the default).
+    """
+    profile = profile or encode.get_profile(cfg)
+    plan = EncodePlan(shift=_alignment_shift(analysis))
+    copy_mode = SHIFT if plan.shift else COPY
+    can_copy = cfg.get('stream_copy', True)
+    if not can_copy:
+        plan.reasons.append("stream copy is off")
+    elif abs(plan.shift) > MAX_COPY_SHIFT:
+        can_copy = False
+        plan.reasons.append(f"alignment shift {plan.shift:.3f}s is too big to copy")
+
+    if probe.video:
+        video = probe.video
+        plan.crop = _crop_rect(crop, probe.width, probe.height)
+        # Scaling comes after cropping
+        width, height = probe.width, probe.height
+        if plan.crop:
+            width, height = plan.crop.get('w', width), plan.crop.get('h', height)
+        resize = cfg.get('resize')
+        if resize and not _scale_is_noop(resize, width, height):
+            plan.resize = resize
+        framerate = cfg.get('framerate')
+        if framerate and not _is_constant_rate(video, framerate):
+            plan.framerate = framerate
+
+        reasons = []
+        if plan.crop:
+            reasons.append("cropping")
+        if plan.resize:
+            reasons.append(f"resizing {width}x{height}")
+        if plan.framerate:
+            reasons.append(f"frame rate {video.get('avg_frame_rate')}")
+        if probe.rotate:
+            reasons.append(f"rotated {probe.rotate}")
+        if video.get('codec_name') != _codec_name(profile.get('codec')):
+            reasons.append(f"video codec {video.get('codec_name')}")
+        if profile.get('pix_fmt') and video.get('pix_fmt') != profile['pix_fmt']:
+            reasons.append(f"pixel format {video.get('pix_fmt')}")
+        plan.reasons.extend(reasons)
+        plan.video = copy_mode if can_copy and not reasons else ENCODE
+
+    if probe.audio:
+        audio = probe.audio
+        samplerate = cfg.get('samplerate')
+        plan.loudnorm = analysis.get('loudnorm') or None
+        # Loudnorm always resamples (it runs at 192k)
+        resample = samplerate and int(audio.get('sample_rate', 0)) != samplerate
+        if plan.loudnorm or resample:
+            plan.samplerate = samplerate
+
+        reasons = []
+        if plan.loudnorm:
+            reasons.append("loudnorm")
+        if plan.samplerate and not plan.loudnorm:
+            reasons.append(f"sample rate {audio.get('sample_rate')}")
+        if audio.get('channels') != CHANNELS:
+            reasons.append(f"{audio.get('channels')} audio channels")
+        if audio.get('codec_name') != _codec_name(profile.get('audio_codec')):
+            reasons.append(f"audio codec {audio.get('codec_name')}")
+        plan.reasons.extend(reasons)
+        plan.audio = copy_mode if can_copy and not reasons else ENCODE
+
+    return plan
+
+
+def video_filter(plan):
+    """Returns a function applying the plan's video filters to a stream."""
+    def apply(video):
+        if plan.crop:
+            video = video.crop(**plan.crop)
+        if plan.resize:
+            video = video.scale(**plan.resize)
+        return video
+    return apply
+
+
+def audio_filter(plan):
+    """Returns a function applying the plan's audio filters to a stream."""
+    def apply(audio):
+        if plan.loudnorm:
+            audio = audio.loudnorm(plan.loudnorm, resample=plan.samplerate)
+        elif plan.samplerate:
+            audio = audio.aresample(plan.samplerate)
+        return audio
+    return apply
+
+
+def output(in_file, out_file, plan, analysis, profile, **kwargs):
+    """Returns the ffmpeg output for a plan.
+
+    Copied streams come from an input shifted by `plan.shift`; re-encoded ones are
+    aligned with filters (see `filters.align_video`) and encoded with `profile`.
+    kwargs are extra output args.
+    """
+    stream = ffmpeg.input(in_file)
+    if SHIFT in (plan.video, plan.audio):
+        shifted = ffmpeg.input(in_file, itsoffset=f'{plan.shift:.6f}')
+    else:
+        shifted = stream
+    streams = []
+    args = {}
+    encode_args = encode.profile_args(
+        profile, video=plan.video == ENCODE, audio=plan.audio == ENCODE)
+
+    if plan.audio == ENCODE:
+        streams.append(audio_filter(plan)(stream.audio.align_audio(analysis)))
+        args['ac'] = CHANNELS
+    elif plan.audio:
+        streams.append(shifted.audio)
+        args['acodec'] = 'copy'
+
+    if plan.video == ENCODE:
+        streams.append(video_filter(plan)(stream.video).align_video(analysis))
+        if plan.framerate:
+            args['r'] = plan.framerate
+    elif plan.video:
+        streams.append(shifted.video)
+        args['vcodec'] = 'copy'
+
+    args['movflags'] = '+faststart'  # allow re-encoding on the fly
+    return ffmpeg.output(*streams, out_file, **{**encode_args, **args, **kwargs})
@@ -0,0 +1,105 @@
+"""Segment-parallel video encoding.
+
+Video is split at keyframes into time segments, which are filtered and encoded by
+separate ffmpeg processes at the same time. Audio is encoded once, in its own
+process, so it stays continuous. The encoded segments are then joined with the
+concat demuxer and muxed with the audio, without re-encoding.
+"""
+
+import bisect
+import logging
+import os
+import tempfile
+
+import ffmpeg
+
+# Segments shorter than this aren't worth a process
+MIN_SEGMENT_SECONDS = 10
+
+
+def plan_segments(keyframes, start, end, count, min_seconds=MIN_SEGMENT_SECONDS):
+    """Splits [start, end) seconds into up to `count` segments at keyframes.
+
+    Returns the boundaries: [start, ..., end]. Each inner boundary is the keyframe
+    closest to an even split, as long as segments stay at least `min_seconds`
+    long.
+    """
+    count = min(count, int((end - start) // min_seconds))
+    bounds = [start]
+    for i in range(1, count):
+        target = start + (end - start) * i / count
+        j = bisect.bisect_left(keyframes, target)
+        candidates = [k for k in keyframes[max(0, j - 1):j + 1]
+                      if k - bounds[-1] >= min_seconds and end - k >= min_seconds]
+        if candidates:
+            bounds.append(min(candidates, key=lambda k: abs(k - target)))
+    bounds.append(end)
+    return bounds
+
+
+def _threads_per_job(jobs):
+    """Splits the cpus between parallel encodes, so they don't oversubscribe."""
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+
+def encode_segmented(in_file, out_file, analysis, profile, duration, segments=None,
+                     video_filter=None, audio_filter=None, framerate=None,
+                     keyframes=None, cmd=None):
+    """Encodes an aligned video in parallel segments.
+
+    `analysis` has the alignment 'pad_seconds' and 'trim_seconds' (see
+    `filters.align_video`); padding is added to the first segment, and trimming
+    moves its start. `video_filter` and `audio_filter` are functions of a stream
+    (e.g. crop and scale, loudnorm) applied to each segment and to the audio.
+    `profile` is an encode profile (see `encode`). `segments` defaults to one per
+    cpu. Video keyframes are probed if `keyframes` isn't given.
+
+    The segment jobs run with `run_all`, so this works from any thread.
+    """
+    from . import encode, keyframe_times, run_all
+    segments = segments or os.cpu_count() or 1
+    if keyframes is None:
+        keyframes = keyframe_times(in_file)
+    trim = max(analysis['trim_seconds'], 0)
+    pad = max(analysis['pad_seconds'], 0)
+    bounds = plan_segments(keyframes, trim, duration, segments)
+    logging.info("Encoding %s in %d segments: %s", in_file, len(bounds) - 1, bounds)
+
+    video_args = encode.profile_args(profile, audio=False)
+    video_args.setdefault('threads', _threads_per_job(len(bounds) - 1))
+    if framerate:
+        video_args['r'] = framerate
+    audio_args = encode.profile_args(profile, video=False)
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(out_file) or None) as tempdir:
+        jobs = []
+        # Audio in one piece
+        audio_file = os.path.join(tempdir, 'audio.m4a')
+        audio = ffmpeg.input(in_file).audio.align_audio(analysis)
+        if audio_filter:
+            audio = audio_filter(audio)
+        jobs.append(audio.output(audio_file, ac=1, **audio_args))
+        # Video in segments
+        concat_list = []
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+            segment_file = os.path.join(tempdir, f'segment{i:03d}.mp4')
+            video = ffmpeg.input(in_file, ss=start, t=end - start).video
+            if video_filter:
+                video = video_filter(video)
+            seconds = end - start
+            if i == 0 and pad:
+                video = video.pad_video(pad)
+                seconds += pad
+            jobs.append(video.output(segment_file, an=None, **video_args))
+            concat_list.append(f"file '{os.path.basename(segment_file)}'\n"
+                               f"duration {seconds:.6f}\n")
+        run_all(jobs, max_jobs=segments + 1, cmd=cmd)
+
+        list_file = os.path.join(tempdir, 'segments.txt')
+        with open(list_file, 'w') as f:
+            f.writelines(concat_list)
+        joined = ffmpeg.input(list_file, format='concat', safe=0)
+        return (ffmpeg
+                .output(joined.video, ffmpeg.input(audio_file).audio, out_file,
+                        c='copy', movflags='+faststart')
+                .run(cmd=cmd, overwrite_output=True))
@@ -3,6 +3,7 @@
 This is a drop-in replacement for the lazy gcp module.
 """
 
+import datetime
 import json
 import shutil
 from pathlib import Path
@@ -84,19 +85,45 @@ class LocalFirestore:
 
 
 class LocalBlob:
-    def __init__(self, path):
+    def __init__(self, path, name=None):
         self.path = path
+        self.name = name or path.name
 
     def download_to_filename(self, filename):
         shutil.copyfile(self.path, filename)
 
+    def download_as_string(self):
+        return self.path.read_bytes()
+
     def upload_from_filename(self, filename):
         self.path.parent.mkdir(parents=True, exist_ok=True)
         shutil.copyfile(filename, self.path)
 
+    def upload_from_string(self, data):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_bytes(data)
+
     def exists(self):
         return self.path.exists()
 
+    def delete(self):
+        self.path.unlink()
+
+    def reload(self):
+        pass
+
+    # Local files don't have generations; see size and updated
+    generation = None
+
+    @property
+    def size(self):
+        return self.path.stat().st_size
+
+    @property
+    def updated(self):
+        return datetime.datetime.fromtimestamp(self.path.stat().st_mtime,
+                                               datetime.timezone.utc)
+
     def create_resumable_upload_session(self, *args, **kwargs):
         # We aren't going to implement a full resumable upload interface anywhere for
         # the local filesystem, so just return the blob's location as a uri
@@ -108,7 +135,13 @@ class LocalBucket:
         self.path = path
 
     def blob(self, name):
-        return LocalBlob(self.path.joinpath(name))
+        return LocalBlob(self.path.joinpath(name), name)
+
+    def list_blobs(self, prefix=''):
+        for p in sorted(self.path.glob('**/*')):
+            name = p.relative_to(self.path).as_posix()
+            if p.is_file() and name.startswith(prefix):
+                yield LocalBlob(p, name)
 
 
 class LocalStorage:
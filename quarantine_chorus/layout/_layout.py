@@ -26,7 +26,9 @@ class Layout:
 
     @classmethod
     def from_files(cls, filenames, *args, **kwargs):
-        return cls(map(LayoutTrack.from_file, filenames), *args, **kwargs)
+        from .. import ffmpeg
+        probes = ffmpeg.probe_many(filenames)
+        return cls(map(LayoutTrack.from_probe, probes), *args, **kwargs)
 
     def copy(self):
         return Layout([v.copy() for v in self.videos],
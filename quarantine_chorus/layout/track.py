@@ -34,9 +34,12 @@ class LayoutTrack:
     @classmethod
     def from_files(cls, filename):
         from .. import ffmpeg
-        probe = ffmpeg.probe(filename)
+        return cls.from_probe(ffmpeg.probe(filename))
+
+    @classmethod
+    def from_probe(cls, probe):
         return cls(
-            name=filename,
+            name=probe.filename,
             width=probe.width,
             height=probe.height,
         )
@@ -0,0 +1,225 @@
+"""EBU R128 loudness measurement of decoded PCM.
+
+Computes integrated loudness, loudness range, and true peak the way ffmpeg's
+ebur128/loudnorm filters and MLT's loudness filter (libebur128) do, following ITU-R
+BS.1770-4 and EBU Tech 3341/3342. Audio is fed in blocks (see `wav.iter_wav`), so
+the same decode can be used for alignment and loudness.
+"""
+
+import logging
+
+import numpy as np
+from scipy import signal
+
+# Loudness of digital silence, and the absolute gate
+ABSOLUTE_GATE = -70.0
+# Gates relative to the ungated loudness, for integrated loudness and range
+RELATIVE_GATE = -10.0
+RANGE_RELATIVE_GATE = -20.0
+# True peak oversampling factor
+OVERSAMPLE = 4
+
+
+def k_weighting(samplerate):
+    """Returns the K-weighting filter (pre-filter then RLB filter) as SOS.
+
+    Uses the same analog prototypes as libebur128, so any sample rate works.
+    """
+    # High shelf (head effects)
+    f0, gain, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / samplerate)
+    vh = 10 ** (gain / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0,
+             2 * (k * k - vh) / a0,
+             (vh - vb * k / q + k * k) / a0,
+             1,
+             2 * (k * k - 1) / a0,
+             (1 - k / q + k * k) / a0]
+    # High pass (revised low-frequency B-curve)
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / samplerate)
+    a0 = 1 + k / q + k * k
+    high_pass = [1, -2, 1,
+                 1,
+                 2 * (k * k - 1) / a0,
+                 (1 - k / q + k * k) / a0]
+    return np.array([shelf, high_pass])
+
+
+def _loudness(power):
+    """Converts K-weighted mean square power (summed over channels) to LUFS."""
+    with np.errstate(divide='ignore'):
+        return -0.691 + 10 * np.log10(power)
+
+
+class LoudnessMeter:
+    """Measures EBU R128 loudness of audio fed in blocks.
+
+    Blocks are arrays of shape (frames,) for mono or (frames, channels), either
+    int16 or floating point in [-1, 1]. `weights` are the BS.1770 channel weights
+    (default: 1 for every channel, which is right for mono and stereo).
+
+    Memory use is a float per 100 ms of audio, plus one block.
+    """
+    def __init__(self, samplerate, channels=1, weights=None):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.weights = np.ones(channels) if weights is None else np.asarray(weights)
+        self._sos = k_weighting(samplerate)
+        self._zi = np.zeros((self._sos.shape[0], 2, channels))
+        # Mean square power of each 100 ms step; momentary (400 ms) and short-term
+        # (3 s) windows are made of 4 and 30 steps
+        self._step = samplerate // 10
+        self._steps = []
+        self._partial = np.zeros(channels)
+        self._partial_count = 0
+        # True peak filter, and enough history to run it across block boundaries
+        self._fir = signal.firwin(12 * OVERSAMPLE, 1 / OVERSAMPLE) * OVERSAMPLE
+        self._history = np.zeros((len(self._fir) // OVERSAMPLE, channels))
+        self.sample_peak = 0.0
+        self._true_peak = 0.0
+
+    def update(self, block):
+        """Adds a block of audio."""
+        block = np.asarray(block)
+        if block.dtype.kind in 'iu':
+            block = block / 32768
+        block = block.reshape(len(block), self.channels)
+        if not len(block):
+            return
+        self.sample_peak = max(self.sample_peak, float(np.abs(block).max()))
+        self._update_true_peak(block)
+        weighted, self._zi = signal.sosfilt(self._sos, block, axis=0, zi=self._zi)
+        self._update_power(weighted * weighted)
+
+    def _update_power(self, squares):
+        i = 0
+        while i < len(squares):
+            n = min(self._step - self._partial_count, len(squares) - i)
+            self._partial += squares[i:i + n].sum(axis=0)
+            self._partial_count += n
+            i += n
+            if self._partial_count == self._step:
+                self._steps.append(float(self.weights @ self._partial) / self._step)
+                self._partial[:] = 0
+                self._partial_count = 0
+
+    def _update_true_peak(self, block):
+        x = np.concatenate([self._history, block])
+        y = signal.upfirdn(self._fir, x, up=OVERSAMPLE, axis=0)
+        # Only outputs that saw the whole filter (the history covers the start)
+        full = y[len(self._fir) - 1:len(x) * OVERSAMPLE]
+        if len(full):
+            self._true_peak = max(self._true_peak, float(np.abs(full).max()))
+        self._history = x[-len(self._history):]
+
+    def _windows(self, steps):
+        """Returns the power of each window of `steps` 100 ms steps (hop of 1)."""
+        power = np.asarray(self._steps)
+        if len(power) < steps:
+            return np.empty(0)
+        cumulative = np.concatenate([[0], np.cumsum(power)])
+        return (cumulative[steps:] - cumulative[:-steps]) / steps
+
+    def _gated_power(self):
+        """Returns (momentary window powers above the absolute gate, their mean)."""
+        power = self._windows(4)
+        power = power[_loudness(power) > ABSOLUTE_GATE]
+        return power, power.mean() if len(power) else 0.0
+
+    def relative_threshold(self):
+        """The relative gate for integrated loudness, in LUFS."""
+        _, mean = self._gated_power()
+        return float(_loudness(mean) + RELATIVE_GATE) if mean else ABSOLUTE_GATE
+
+    def integrated(self):
+        """Integrated loudness in LUFS (-70 for silence)."""
+        power, mean = self._gated_power()
+        if not mean:
+            return ABSOLUTE_GATE
+        power = power[_loudness(power) > _loudness(mean) + RELATIVE_GATE]
+        return max(float(_loudness(power.mean())), ABSOLUTE_GATE)
+
+    def loudness_range(self):
+        """Loudness range (LRA) in LU."""
+        loudness = _loudness(self._windows(30))
+        loudness = loudness[loudness > ABSOLUTE_GATE]
+        if not len(loudness):
+            return 0.0
+        power = 10 ** ((loudness + 0.691) / 10)
+        gate = _loudness(power.mean()) + RANGE_RELATIVE_GATE
+        loudness = loudness[loudness > gate]
+        if not len(loudness):
+            return 0.0
+        low, high = np.percentile(loudness, [10, 95])
+        return float(high - low)
+
+    def true_peak(self):
+        """True peak in dBTP."""
+        peak = max(self._true_peak, self.sample_peak)
+        with np.errstate(divide='ignore'):
+            return float(max(20 * np.log10(peak), -144.0))
+
+    def loudnorm(self, params):
+        """Returns a dict like `ffmpeg.run_loudnorm_analysis`.
+
+        `params` should include i, tp, and lra. The output_* values predict a
+        linear (gain only) normalization, which is what the second loudnorm pass
+        uses when it can; ffmpeg's first pass runs the dynamic normalizer instead,
+        so they can differ slightly when that isn't possible.
+        """
+        input_i = self.integrated()
+        input_tp = self.true_peak()
+        input_lra = self.loudness_range()
+        input_thresh = self.relative_threshold()
+        gain = params['i'] - input_i
+        linear = input_lra <= params['lra'] and input_tp + gain <= params['tp']
+        d = {
+            'input_i': input_i,
+            'input_tp': input_tp,
+            'input_lra': input_lra,
+            'input_thresh': input_thresh,
+            'output_i': input_i + gain,
+            'output_tp': input_tp + gain,
+            'output_lra': input_lra,
+            'output_thresh': input_thresh + gain,
+            'normalization_type': 'linear' if linear else 'dynamic',
+            'target_offset': 0.0,
+        }
+        # loudnorm prints strings with two decimal places
+        d = {k: v if isinstance(v, str) else f'{v:.2f}' for k, v in d.items()}
+        d.update(params)
+        return d
+
+    def melt(self, target=-23):
+        """Returns a dict like `mlt.melt.loudness_analysis`."""
+        ret = {
+            'program': target,
+            'L': self.integrated(),
+            'R': self.loudness_range(),
+            'P': self.sample_peak,
+        }
+        # Same format as MLT's loudness filter results property
+        ret['results'] = 'L: {L:f}\tR: {R:f}\tP {P:f}'.format(**ret)
+        return ret
+
+
+def measure(blocks, samplerate, channels=1, weights=None):
+    """Runs a LoudnessMeter over an iterable of blocks, returning the meter."""
+    meter = LoudnessMeter(samplerate, channels, weights)
+    for block in blocks:
+        meter.update(block)
+    return meter
+
+
+def measure_file(filename, samplerate=48000, channels=2, **kwargs):
+    """Decodes a file a block at a time, returning a LoudnessMeter for it.
+
+    kwargs are passed to `wav.iter_wav`.
+    """
+    from .wav import iter_wav
+    logging.info("Measuring loudness of %s", filename)
+    return measure(iter_wav(filename, samplerate, channels=channels, **kwargs),
+                   samplerate, channels)
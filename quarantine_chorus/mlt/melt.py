@@ -4,6 +4,8 @@ import logging
 import re
 import subprocess
 
+from .. import procstats
+
 
 EXECUTABLE = 'melt'
 
@@ -85,10 +87,10 @@ class MeltNode:
         return self._append('-track')
 
     def run_async(self, cmd=None, **kwargs):
-        return _run(subprocess.Popen, self.args, cmd, **kwargs)
+        return _run(procstats.Popen, self.args, cmd, **kwargs)
 
     def run(self, cmd=None, encoding='utf-8', **kwargs):
-        proc = _run(subprocess.run, self.args, cmd, encoding=encoding, **kwargs)
+        proc = _run(procstats.run, self.args, cmd, encoding=encoding, **kwargs)
         proc.check_returncode()
         return proc.stdout, proc.stderr
 
@@ -115,9 +117,17 @@ def loudness_analysis(filename, target=-23, cmd=None):
         .flag(silent=True)
         .run(pipe_stdout=True)
     )
-    # Parse output. The relevant line looks like:
+    return parse_loudness_results(stdout, target)
+
+
+def parse_loudness_results(output, target=-23):
+    """Parses the loudness filter's results from melt's xml output.
+
+    Returns a map like `loudness_analysis`, or None if there are no results.
+    """
+    # The relevant line looks like:
     # <property name="results">L: -28.586770    R: 10.149692    P 0.186446</property>
-    m = re.search(r'(?:[LRP]:?\s*[\-\d.]+\s*){3}', stdout)
+    m = re.search(r'(?:[LRP]:?\s*[\-\d.]+\s*){3}', output)
     if m is not None:
         ret = {
             'results': m.group(),
@@ -0,0 +1,236 @@
+"""Resource accounting for external processes (ffmpeg, ffprobe, ffplay, melt).
+
+Processes started with `Popen` (or `run`) record their wall time, user and system
+CPU time, max RSS, and exit code when they're reaped, and send the record to every
+sink (see `add_sink`). Sinks are callables that take a ProcessRecord; LogSink,
+JSONLinesSink and Aggregator are provided, and logging is on by default.
+
+CPU time and max RSS come from `os.wait4`, so they're only available on POSIX
+systems, for processes reaped by `Popen` (not ones run with asyncio).
+"""
+
+import dataclasses as dc
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional
+
+
+@dc.dataclass
+class ProcessRecord:
+    program: str
+    fingerprint: str
+    args: List[str]
+    returncode: Optional[int]
+    wall_seconds: float
+    user_seconds: Optional[float] = None
+    system_seconds: Optional[float] = None
+    max_rss_mb: Optional[float] = None
+
+    @property
+    def cpu_seconds(self):
+        if self.user_seconds is None:
+            return None
+        return self.user_seconds + self.system_seconds
+
+    def to_dict(self):
+        return dc.asdict(self)
+
+
+def _program(args):
+    return os.path.splitext(os.path.basename(str(args[0])))[0]
+
+
+def fingerprint(args):
+    """Returns a short hash identifying the kind of command.
+
+    File names (arguments that exist, or look like paths) are replaced by their
+    extension, so the same command on different files has the same fingerprint.
+    """
+    def normalize(arg):
+        arg = str(arg)
+        if os.sep in arg or '/' in arg or os.path.exists(arg):
+            return '<file{}>'.format(os.path.splitext(arg)[1])
+        return arg
+
+    parts = [_program(args)] + [normalize(a) for a in args[1:]]
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()[:12]
+
+
+def _max_rss_mb(ru_maxrss):
+    # linux reports kilobytes; mac reports bytes
+    return ru_maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+# == Sinks ==
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink):
+    """Sends process records to `sink`, a callable taking a ProcessRecord."""
+    with _sinks_lock:
+        _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        _sinks.remove(sink)
+
+
+def emit(record):
+    """Sends a ProcessRecord to every sink. Errors in sinks are logged, not raised."""
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        try:
+            sink(record)
+        except Exception:
+            logging.exception("Process record sink %r failed", sink)
+
+
+def record(args, returncode, wall_seconds, rusage=None):
+    """Builds a ProcessRecord for a finished process and emits it."""
+    r = ProcessRecord(
+        program=_program(args),
+        fingerprint=fingerprint(args),
+        args=[str(a) for a in args],
+        returncode=returncode,
+        wall_seconds=wall_seconds,
+    )
+    if rusage is not None:
+        r.user_seconds = rusage.ru_utime
+        r.system_seconds = rusage.ru_stime
+        r.max_rss_mb = _max_rss_mb(rusage.ru_maxrss)
+    emit(r)
+    return r
+
+
+class LogSink:
+    """Logs a line per process."""
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def __call__(self, r):
+        cpu = 'n/a' if r.cpu_seconds is None else f'{r.cpu_seconds:.2f}s'
+        rss = 'n/a' if r.max_rss_mb is None else f'{r.max_rss_mb:.1f}MB'
+        logging.log(self.level, "%s [%s] exited %s: wall %.2fs, cpu %s, max rss %s",
+                    r.program, r.fingerprint, r.returncode, r.wall_seconds, cpu, rss)
+
+
+class JSONLinesSink:
+    """Appends a JSON object per process to a file."""
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def __call__(self, r):
+        line = json.dumps(r.to_dict()) + '\n'
+        with self._lock, open(self.filename, 'a') as f:
+            f.write(line)
+
+
+class Aggregator:
+    """Keeps totals per program (or another key), e.g. to log at the end of a run.
+
+        totals = procstats.add_sink(procstats.Aggregator())
+        ...
+        logging.info("Processes: %s", totals.summary())
+    """
+    def __init__(self, key=lambda r: r.program, keep_records=False):
+        self.key = key
+        self.records = [] if keep_records else None
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, r):
+        with self._lock:
+            if self.records is not None:
+                self.records.append(r)
+            t = self._totals.setdefault(self.key(r), {
+                'count': 0, 'failures': 0, 'wall_seconds': 0.0,
+                'user_seconds': 0.0, 'system_seconds': 0.0, 'max_rss_mb': 0.0,
+            })
+            t['count'] += 1
+            t['failures'] += bool(r.returncode)
+            t['wall_seconds'] += r.wall_seconds
+            t['user_seconds'] += r.user_seconds or 0.0
+            t['system_seconds'] += r.system_seconds or 0.0
+            t['max_rss_mb'] = max(t['max_rss_mb'], r.max_rss_mb or 0.0)
+
+    def summary(self):
+        """Returns {key: totals}, with the most CPU-hungry keys first."""
+        with self._lock:
+            items = sorted(self._totals.items(),
+                           key=lambda kv: -(kv[1]['user_seconds']
+                                            + kv[1]['system_seconds']))
+            return {k: dict(v) for k, v in items}
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+            if self.records is not None:
+                self.records.clear()
+
+
+add_sink(LogSink())
+
+
+# == Processes ==
+
+class Popen(subprocess.Popen):
+    """A subprocess.Popen that emits a ProcessRecord when the process is reaped."""
+    def __init__(self, args, *pargs, **kwargs):
+        self._start_time = time.perf_counter()
+        self._rusage = None
+        self._recorded = False
+        super().__init__(args, *pargs, **kwargs)
+
+    if hasattr(os, 'wait4'):
+        # Reap with wait4 instead of waitpid, to get the child's resource usage.
+        # These are the hooks Popen uses to reap on POSIX.
+        def _wait4(self, pid, flags):
+            pid, status, rusage = os.wait4(pid, flags)
+            if pid:
+                self._rusage = rusage
+            return pid, status
+
+        def _try_wait(self, wait_flags):
+            try:
+                return self._wait4(self.pid, wait_flags)
+            except ChildProcessError:
+                # Reaped elsewhere, e.g. by a SIGCLD handler
+                return self.pid, 0
+
+        def _internal_poll(self, _deadstate=None, **kwargs):
+            return super()._internal_poll(_deadstate=_deadstate, _waitpid=self._wait4)
+
+    def _record(self):
+        if self.returncode is not None and not self._recorded:
+            self._recorded = True
+            record(self.args, self.returncode,
+                   time.perf_counter() - self._start_time, self._rusage)
+
+    def poll(self):
+        returncode = super().poll()
+        self._record()
+        return returncode
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        self._record()
+        return returncode
+
+
+def run(args, input=None, **kwargs):
+    """Like subprocess.run (without check or timeout), using `Popen`."""
+    with Popen(args, **kwargs) as proc:
+        stdout, stderr = proc.communicate(input)
+    return subprocess.CompletedProcess(args, proc.returncode, stdout, stderr)
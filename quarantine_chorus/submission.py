@@ -46,10 +46,24 @@ class _GCS:
             self._blob_cache = self._bucket.blob(self.name)
         return self._blob_cache
 
+    def with_suffix(self, suffix):
+        """Returns an object in the same bucket with `suffix` added to the name."""
+        return _GCS(self.storage_client, self.bucket_name, self.name + suffix)
+
     def exists(self):
         """Does a blob with this name exist?"""
         return self._blob.exists()
 
+    def version(self):
+        """Identifies the current contents of the object, e.g. for cache keys.
+
+        Uses the blob's generation, plus its size and update time (all there is
+        for local storage).
+        """
+        blob = self._blob
+        blob.reload()
+        return [self.url, blob.generation, blob.size, str(blob.updated)]
+
     def download(self, file_or_filename, **kwargs):
         """Downloads to an open file-like object or a filename."""
         if isinstance(file_or_filename, str):
@@ -64,6 +78,18 @@ class _GCS:
         else:
             return self._blob.upload_from_file(file_or_filename, **kwargs)
 
+    def download_bytes(self, **kwargs):
+        """Downloads the object's contents as bytes."""
+        return self._blob.download_as_string(**kwargs)
+
+    def upload_bytes(self, data, **kwargs):
+        """Uploads bytes as the object's contents."""
+        return self._blob.upload_from_string(data, **kwargs)
+
+    def delete(self):
+        """Deletes the blob."""
+        return self._blob.delete()
+
     def create_resumable_upload_session(self, content_type, size, origin=None):
         """Creates and returns a resumable upload url.
 
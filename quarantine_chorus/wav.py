@@ -1,16 +1,298 @@
+import logging
+import os
+import threading
+
 import numpy as np
 
 from . import ffmpeg
 
 
-def read_wav(filename, samplerate=44100):
-    """Reads PCM audio from a file, returning a numpy array."""
-    # This is both faster (slightly) and uses less memory (significantly) than doing
-    # this via pydub.AudioSegment
-    proc = (ffmpeg
-            .input(filename)
-            .output('-', format='s16le', acodec='pcm_s16le', ac=1, ar=samplerate,
-                    af=f'aresample={samplerate}:first_pts=0')
-            .overwrite_output()
-            .run_async(pipe_stdout=True))
-    return np.frombuffer(proc.stdout.read(), dtype=np.dtype('<i2'))
+# Raw sample formats: ffmpeg format, ffmpeg codec, numpy dtype. The 8-bit formats
+# take half the memory, and are plenty for loudness analysis (see align.BitMask).
+SAMPLE_FORMATS = {
+    's16': ('s16le', 'pcm_s16le', np.dtype('<i2')),
+    's8': ('s8', 'pcm_s8', np.dtype('i1')),
+    'u8': ('u8', 'pcm_u8', np.dtype('u1')),
+}
+
+
+def convert(wav, sample_format, block_size=2**16):
+    """Converts int16 samples to another sample format, a block at a time."""
+    dtype = SAMPLE_FORMATS[sample_format][2]
+    if wav.dtype == dtype:
+        return wav
+    out = np.empty(wav.shape, dtype=dtype)
+    for i in range(0, len(wav), block_size):
+        block = wav[i:i + block_size] >> 8
+        if sample_format == 'u8':
+            block += 128
+        out[i:i + block_size] = block
+    return out
+
+
+# See `set_pcm_cache`
+_pcm_cache = None
+
+
+def set_pcm_cache(path, max_size=None):
+    """Caches decoded PCM as .npy files in the directory `path`.
+
+    `read_wav` memory-maps cached PCM instead of decoding a file again, as long as
+    the file's size and modification time are unchanged. Least recently used files
+    are evicted once the cache is over `max_size` bytes. A `path` of None turns the
+    cache off.
+    """
+    global _pcm_cache
+    from .cache import LocalStore
+    _pcm_cache = LocalStore(path, max_size) if path else None
+
+
+def _pcm_cache_key(filename, samplerate, channels, stream, sample_format):
+    from .cache import hash_params
+    stat = os.stat(filename)
+    return 'pcm-' + hash_params(os.path.abspath(filename), stat.st_size,
+                                stat.st_mtime_ns, samplerate=samplerate,
+                                channels=channels, stream=stream or 0,
+                                sample_format=sample_format) + '.npy'
+
+
+def sidecar_suffix(samplerate):
+    """Returns the suffix for an analysis sidecar at `samplerate`."""
+    return f'.s16-{samplerate}.npy'
+
+
+def sidecar_name(filename, samplerate):
+    """Returns the name of the analysis sidecar for an audio file.
+
+    Sidecars hold mono int16 PCM at the analysis sample rate in .npy format, so they
+    can be memory-mapped instead of decoding the audio file again.
+    """
+    return filename + sidecar_suffix(samplerate)
+
+
+def write_sidecar(filename, samplerate, pcm=None):
+    """Writes the analysis sidecar of an audio file. Returns the name.
+
+    `pcm` is the file's mono PCM at `samplerate`, if it's already decoded; otherwise
+    the file is decoded. Write the sidecar after the audio file, or it's stale.
+    """
+    sidecar = sidecar_name(filename, samplerate)
+    if pcm is None:
+        pcm = read_wav(filename, samplerate, use_sidecar=False)
+    logging.info("Writing analysis sidecar %s", sidecar)
+    np.save(sidecar, pcm)
+    return sidecar
+
+
+def _read_sidecar(filename, samplerate):
+    """Memory-maps an up to date sidecar for `filename`, if there is one."""
+    sidecar = sidecar_name(filename, samplerate)
+    try:
+        if os.path.getmtime(sidecar) < os.path.getmtime(filename):
+            logging.info("Ignoring stale analysis sidecar %s", sidecar)
+            return None
+    except OSError:
+        return None
+    logging.info("Using analysis sidecar %s", sidecar)
+    return np.load(sidecar, mmap_mode='r')
+
+
+class Decoder:
+    """Decodes audio with ffmpeg to raw PCM, read straight into arrays.
+
+    Samples are in `sample_format` (see SAMPLE_FORMATS), so arrays should have the
+    matching dtype (`self.dtype`). Multi-channel audio is interleaved, so arrays
+    should have a shape of (frames, channels).
+
+    Decodes `duration` seconds starting at `start` seconds (seeking on the input,
+    so skipped audio isn't decoded) of audio stream number `stream`. Video is
+    ignored.
+
+    To get more than PCM out of one decode, pass an ffmpeg audio stream as `audio`
+    (e.g. one output of `asplit`) to decode it instead of reading `filename`, and
+    the other outputs as `outputs`; they all run in the same ffmpeg process. After
+    the context, `stderr` holds ffmpeg's stderr output.
+
+    Use as a context manager. Leaving the context early (e.g. after reading only
+    part of the file, or on an exception) stops ffmpeg; either way the process is
+    reaped. If ffmpeg fails after the whole stream has been read, raises
+    `ffmpeg.Error` with its stderr output.
+    """
+    def __init__(self, filename, samplerate=44100, duration=None, channels=1,
+                 start=None, stream=None, sample_format='s16', audio=None,
+                 outputs=()):
+        self.filename = filename
+        self.samplerate = samplerate
+        self.duration = duration
+        self.channels = channels
+        self.start = start
+        self.stream = stream
+        self.sample_format = sample_format
+        self.dtype = SAMPLE_FORMATS[sample_format][2]
+        self.audio = audio
+        self.outputs = outputs
+        self.proc = None
+        self.eof = False
+        self._stderr = []
+
+    def __enter__(self):
+        audio = self.audio
+        if audio is None:
+            input_args = {}
+            if self.start:
+                input_args['ss'] = self.start
+            if self.duration:
+                input_args['t'] = self.duration
+            audio = ffmpeg.input(self.filename, **input_args)[f'a:{self.stream or 0}']
+        samplerate = self.samplerate
+        audio_format, audio_codec, _ = SAMPLE_FORMATS[self.sample_format]
+        # A filter node rather than -af, which can't be used on the output of a
+        # filter graph (as `self.audio` may be)
+        pcm = (audio
+               .filter('aresample', samplerate, first_pts=0)
+               .output('-', format=audio_format, acodec=audio_codec, vn=None,
+                       ac=self.channels, ar=samplerate))
+        self.proc = (ffmpeg.merge_outputs(pcm, *self.outputs)
+                     .overwrite_output()
+                     .run_async(pipe_stdout=True, pipe_stderr=True))
+        # Drain stderr as we go, so that ffmpeg never blocks on a full pipe
+        self._stderr_thread = threading.Thread(
+            target=lambda: self._stderr.append(self.proc.stderr.read()), daemon=True
+        )
+        self._stderr_thread.start()
+        return self
+
+    def readinto(self, buf):
+        """Fills an array with samples, returning how many frames were read.
+
+        Returns fewer than `len(buf)` frames only at the end of the stream.
+        """
+        view = memoryview(buf).cast('B')
+        count = 0
+        while count < len(view):
+            n = self.proc.stdout.readinto(view[count:])
+            if not n:
+                self.eof = True
+                break
+            count += n
+        return count // (self.dtype.itemsize * self.channels)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.eof:
+            self.proc.kill()
+        self.proc.stdout.close()
+        returncode = self.proc.wait()
+        self._stderr_thread.join()
+        self.proc.stderr.close()
+        if exc_type is None and self.eof and returncode != 0:
+            stderr = self.stderr
+            # The end of the output is where the error is
+            logging.error("ffmpeg failed decoding %s: %s", self.filename,
+                          stderr[-4096:].decode(errors='replace'))
+            raise ffmpeg.Error('ffmpeg', None, stderr)
+
+    @property
+    def stderr(self):
+        return b''.join(self._stderr)
+
+
+def _shape(frames, channels):
+    return (frames,) if channels == 1 else (frames, channels)
+
+
+def iter_wav(filename, samplerate=44100, duration=None, block_size=2**16,
+             channels=1, sample_format='s16'):
+    """Decodes PCM audio from a file, yielding arrays of up to `block_size` frames.
+
+    Only one block is held at a time (unless the caller keeps them). Closing the
+    generator early stops ffmpeg.
+    """
+    with Decoder(filename, samplerate, duration, channels,
+                 sample_format=sample_format) as decoder:
+        while not decoder.eof:
+            block = np.empty(_shape(block_size, channels), dtype=decoder.dtype)
+            n = decoder.readinto(block)
+            if n:
+                yield block[:n]
+
+
+def _probe_duration(filename):
+    """Returns the duration of a media file in seconds, or None if unknown."""
+    try:
+        return ffmpeg.probe(filename).duration or None
+    except (ffmpeg.Error, AttributeError):
+        return None
+
+
+def read_wav(filename, samplerate=44100, duration=None, use_sidecar=True,
+             channels=1, start=None, stream=None, sample_format='s16'):
+    """Reads PCM audio from a file, returning a numpy array.
+
+    If `start` is given, skips that many seconds without decoding them. If
+    `duration` is given, stops decoding after that many seconds. `stream` picks an
+    audio stream by index (default: the first). Arrays of more than one channel
+    have a shape of (frames, channels). `sample_format` is one of SAMPLE_FORMATS.
+
+    If the file has an up to date analysis sidecar for this sample rate (see
+    `sidecar_name`), or decoded PCM in the PCM cache (see `set_pcm_cache`),
+    memory-maps that instead of decoding the file (the result is read-only).
+    Otherwise, samples are decoded straight into a writable array, sized from
+    `duration` or the probed duration of the file.
+    """
+    def truncate(wav):
+        first = int(round((start or 0) * samplerate))
+        return wav[first:first + int(duration * samplerate) if duration else None]
+
+    if use_sidecar and channels == 1 and not stream:
+        wav = _read_sidecar(filename, samplerate)
+        if wav is not None:
+            return convert(truncate(wav), sample_format)
+    pcm_cache = _pcm_cache
+    if pcm_cache is not None:
+        key = _pcm_cache_key(filename, samplerate, channels, stream, sample_format)
+        path = pcm_cache.get_path(key)
+        if path is not None:
+            logging.info("Using cached pcm %s for %s", path, filename)
+            return truncate(np.load(path, mmap_mode='r'))
+
+    wav = _decode(filename, samplerate, duration, channels, start, stream,
+                  sample_format)
+    # Only whole files are cached
+    if pcm_cache is not None and not duration and not start:
+        logging.info("Caching pcm for %s", filename)
+        with pcm_cache.writer(key) as f:
+            np.save(f, wav)
+    return wav
+
+
+def _decode(filename, samplerate, duration, channels, start, stream, sample_format):
+    """Decodes a file into a preallocated array, growing it if needed."""
+    expected = duration
+    if not expected:
+        expected = _probe_duration(filename)
+        if expected and start:
+            expected = max(0, expected - start)
+    with Decoder(filename, samplerate, duration, channels, start, stream,
+                 sample_format) as decoder:
+        return read_all(decoder, expected)
+
+
+def read_all(decoder, expected_duration=None):
+    """Reads everything from an open Decoder into one array.
+
+    The array is preallocated for `expected_duration` seconds, and grown if the
+    audio turns out to be longer.
+    """
+    samplerate, channels = decoder.samplerate, decoder.channels
+    # Leave a second for rounding and for containers that under-report duration;
+    # without a duration, start with a minute and grow as needed
+    size = int((expected_duration or 59) * samplerate) + samplerate
+    wav = np.empty(_shape(size, channels), dtype=decoder.dtype)
+    count = decoder.readinto(wav)
+    while not decoder.eof:
+        logging.info("Decoded audio is longer than expected; growing buffer")
+        grown = np.empty(_shape(2 * len(wav), channels), dtype=wav.dtype)
+        grown[:count] = wav[:count]
+        wav = grown
+        count += decoder.readinto(wav[count:])
+    return wav[:count]
@@ -9,6 +9,7 @@ import wx
 
 from quarantine_chorus import ffmpeg
 from quarantine_chorus import mlt
+from quarantine_chorus import wav
 
 from . import util
 from .logging import StreamToLogger, LogEventHandler, EVT_LOG
@@ -21,6 +22,11 @@ from .ui.Frame import Frame
 
 LOG_FORMAT = "%(asctime)s [%(threadName)s][%(pathname)s:%(funcName)s:%(lineno)d] %(levelname)s: %(message)s"
 
+# Decoded audio is cached between analyses (and runs) up to this many bytes
+PCM_CACHE_SIZE = 2 * 2**30
+# Probe results are small, but there's no need to keep them forever
+PROBE_CACHE_SIZE = 16 * 2**20
+
 
 class App(wx.App):
     def OnInit(self):
@@ -43,6 +49,12 @@ class App(wx.App):
         # Find ffmpeg, etc
         if not self.SetExecutables():
             return False
+        pcm_cache_dir = Path(wx.StandardPaths.Get().GetUserLocalDataDir(), 'pcm_cache')
+        logging.info("Caching decoded audio in %s", pcm_cache_dir)
+        wav.set_pcm_cache(pcm_cache_dir, max_size=PCM_CACHE_SIZE)
+        probe_cache_dir = Path(wx.StandardPaths.Get().GetUserLocalDataDir(),
+                               'probe_cache')
+        ffmpeg.set_probe_cache(probe_cache_dir, max_size=PROBE_CACHE_SIZE)
         # Setup threadpool
         max_workers = os.cpu_count()
         logging.info("Initializing pool with %d worker threads.", max_workers)
@@ -62,11 +62,18 @@ def _shjoin(args):
     return ' '.join(shlex.quote(arg) for arg in args)
 
 
+def preview_output(streams, profile='preview', audio_only=False):
+    """Returns an mpegts output to stdout, encoded with an encode profile."""
+    return ffmpeg.encode.output(*streams, 'pipe:', format='mpegts',
+                                profile=ffmpeg.encode.get_profile(name=profile),
+                                video=not audio_only)
+
+
 def preview_thread(tracks, **kwargs):
     streams = ffmpeg_mix(tracks, **kwargs)
+    output = preview_output(streams, audio_only=kwargs.get('audio_only', False))
     if os.name == 'nt':
-        ffmpeg_proc = (ffmpeg.output(*streams, 'pipe:', format='mpegts')
-                       .run_async(pipe_stdout=True))
+        ffmpeg_proc = output.run_async(pipe_stdout=True)
         ffmpeg.play('pipe:', window_title='Preview', stdin=ffmpeg_proc.stdout)
         # No need to keep the ffmpeg process around after ffplay has stopped
         ffmpeg_proc.stdout.close()
@@ -76,8 +83,7 @@ def preview_thread(tracks, **kwargs):
         # from the command line, but not when running the bundled app. Running ffmpeg
         # works fine either way, the ffplay window never pops up. Instead, build a
         # pipeline and run using the shell, which seems to work
-        ffmpeg_cmd = (ffmpeg.output(*streams, 'pipe:', format='mpegts')
-                      .compile(ffmpeg.EXECUTABLE))
+        ffmpeg_cmd = output.compile(ffmpeg.EXECUTABLE)
         ffplay_cmd = [ffmpeg._play.EXECUTABLE, '-i', 'pipe:']
         cmd = _shjoin(ffmpeg_cmd) + ' | ' + _shjoin(ffplay_cmd)
         logging.info("Running preview command: %s", cmd)
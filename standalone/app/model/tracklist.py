@@ -1,10 +1,11 @@
+import logging
 from pathlib import Path
 
 import wx
 
 from quarantine_chorus import align
 from quarantine_chorus import ffmpeg
-from quarantine_chorus import mlt
+from quarantine_chorus import loudness
 
 from .observable import Observable
 
@@ -64,11 +65,13 @@ class _TrackList(Observable):
     # Mutators
 
     def add(self, *paths):
+        new_paths = []
         for path in paths:
             if path not in self.track_order:
                 self.track_order.append(path)
                 self.tracks[path] = self._new(path)
-                self.probe_track(path)
+                new_paths.append(path)
+        self.probe_tracks(new_paths)
         self.notify()
 
     def remove(self, *paths):
@@ -142,10 +145,25 @@ class _TrackList(Observable):
 
     # Background events
 
-    def probe_track(self, path):
-        wx.GetApp().RunInBackground(ffmpeg.probe, path, callback=self.update_from_probe)
-
-    def align_track(self, reference, subject):
+    def probe_tracks(self, paths):
+        def on_complete(probes):
+            for path, probe in zip(paths, probes):
+                if isinstance(probe, Exception):
+                    logging.error("Unable to probe %s: %r", path, probe)
+                else:
+                    self.update_from_probe(probe)
+
+        if paths:
+            wx.GetApp().RunInBackground(ffmpeg.probe_many, paths,
+                                        return_exceptions=True, callback=on_complete)
+
+    def align_tracks(self, reference, subjects):
+        # Share one aligner so the reference is only decoded and transformed once
+        aligner = align.Aligner(reference, samplerate=22400, preprocess='loudness_25')
+        for subject in subjects:
+            self.align_track(aligner, subject)
+
+    def align_track(self, aligner, subject):
         self.set_status(subject, 'alignment', 'running')
 
         def on_complete(analysis):
@@ -153,9 +171,7 @@ class _TrackList(Observable):
             self.merge(subject, alignment_analysis=analysis)
 
         wx.GetApp().RunInBackground(
-            lambda: align.cross_correlate(reference, subject,
-                                          samplerate=22400,
-                                          preprocess='loudness_25')[0],
+            lambda: aligner.align(subject).analysis,
             callback=on_complete)
 
     def normalize_track(self, path, target):
@@ -165,8 +181,9 @@ class _TrackList(Observable):
             self.set_status(path, 'loudness', 'complete')
             self.set_filter(path, 'loudness', result)
 
+        # Same results as mlt.melt.loudness_analysis, without running melt
         wx.GetApp().RunInBackground(
-            mlt.melt.loudness_analysis, path, target,
+            lambda: loudness.measure_file(path).melt(target),
             callback=on_complete)
 
 
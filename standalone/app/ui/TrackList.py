@@ -235,8 +235,7 @@ class TrackListPanel(base.TrackListPanel):
         )
         if reference:
             tracks = self.GetSelectedTrackNames() or TrackList.track_names()
-            for path in tracks:
-                TrackList.align_track(reference, path)
+            TrackList.align_tracks(reference, tracks)
 
     def OnNormalize(self, evt):
         target = wx.GetNumberFromUser(
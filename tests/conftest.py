@@ -0,0 +1,29 @@
+import os
+import sys
+import textwrap
+
+import pytest
+
+# Tests import quarantine_chorus from the repo, like the functions and standalone app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path):
+    """Returns a cmd for a fake ffmpeg that only reports progress.
+
+    It fails if its input is named 'fail', and appends its args to `args.jsonl`
+    in its directory.
+    """
+    script = tmp_path / 'fake_ffmpeg.py'
+    script.write_text(textwrap.dedent('''\
+        import json
+        import os
+        import sys
+        with open(os.path.join(os.path.dirname(__file__), 'args.jsonl'), 'a') as f:
+            f.write(json.dumps(sys.argv[1:]) + '\\n')
+        if sys.argv[sys.argv.index('-i') + 1] == 'fail':
+            sys.exit(1)
+        sys.stderr.write('out_time_us=1000000\\nspeed=2x\\nprogress=end\\n')
+    '''))
+    return [sys.executable, str(script)]
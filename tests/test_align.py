@@ -0,0 +1,171 @@
+import numpy as np
+import pytest
+import scipy.signal as signal
+
+from quarantine_chorus import align
+from quarantine_chorus import benchmark
+from quarantine_chorus.cache import LocalStore
+
+SAMPLERATE = 8000
+
+LOUDNESS = ['loudness_25', 'loudness_50', 'loudness_75']
+
+
+def baseline_cross_correlate(reference, subject, samplerate, min_shift=None,
+                             max_shift=None, preprocess=None):
+    """`cross_correlate` as it was before any of the optimizations, for arrays."""
+    def loudness(wav, ratio):
+        max_sample = np.percentile(wav, 99.5)
+        cutoff = int(ratio * max_sample)
+        normalized = wav - cutoff
+        np.clip(normalized, 0, 1, out=normalized)
+        normalized *= int(max_sample)
+        return normalized
+
+    ref_wav, subj_wav = reference, subject
+    if preprocess and preprocess != 'none':
+        ratio = int(preprocess.split('_')[1]) / 100
+        ref_wav, subj_wav = loudness(ref_wav, ratio), loudness(subj_wav, ratio)
+    min_shift = min_shift or int(-len(subj_wav) / 2)
+    max_shift = max_shift or int(len(subj_wav) / 2)
+    corr = signal.fftconvolve(ref_wav, subj_wav[::-1], mode='full')
+    corr_start = -len(subj_wav)
+    corr_end = len(ref_wav)
+    corr_zero = -corr_start
+    corr_slice = corr[corr_zero + min_shift:corr_zero + max_shift]
+    corr_best_index = int(np.argmax(np.abs(corr_slice)))
+    corr_best = abs(corr_slice[corr_best_index])
+    corr_shift = corr_best_index + min_shift
+    analysis = {
+        'correlation_start': corr_start,
+        'correlation_end': corr_end,
+        'correlation_shift': corr_shift,
+        'correlation_window_min': min_shift,
+        'correlation_window_max': max_shift,
+        'trim': -corr_shift if corr_shift < 0 else 0,
+        'pad': corr_shift if corr_shift > 0 else 0,
+    }
+    for k, v in list(analysis.items()):
+        analysis[k + '_seconds'] = v / samplerate
+    return analysis, corr / corr_best
+
+
+@pytest.fixture(scope='module')
+def pair():
+    return benchmark.synthetic_pair(SAMPLERATE, duration=10, shift=0.5)
+
+
+def assert_matches_baseline(pair, baseline_kwargs=None, **kwargs):
+    reference, subject, _ = pair
+    expected, _ = baseline_cross_correlate(reference, subject, SAMPLERATE,
+                                           **(kwargs if baseline_kwargs is None else baseline_kwargs))
+    result = align.cross_correlate(reference, subject, SAMPLERATE, **kwargs)
+    assert result.shift == expected['correlation_shift']
+    return expected, result
+
+
+@pytest.mark.parametrize('preprocess', [None, 'none'] + LOUDNESS)
+@pytest.mark.parametrize('mode', [
+    {'method': 'fft'},
+    {'method': 'direct'},
+    {'method': 'blocks'},
+    {'method': 'auto'},
+    {'coarse_samplerate': 1000},
+    {'dtype': 'float32'},
+    {'memory_budget_mb': 1000},
+])
+def test_shift_matches_baseline(pair, preprocess, mode):
+    assert_matches_baseline(pair, {'preprocess': preprocess},
+                            preprocess=preprocess, **mode)
+
+
+@pytest.mark.parametrize('method', ['fft', 'direct', 'blocks', 'auto'])
+@pytest.mark.parametrize('window', [(-14000, -10000), (-12500, 3000)])
+def test_windowed_analysis_matches_baseline(pair, method, window):
+    min_shift, max_shift = window
+    expected, result = assert_matches_baseline(
+        pair, {'min_shift': min_shift, 'max_shift': max_shift},
+        min_shift=min_shift, max_shift=max_shift, method=method)
+    # Only the part of the subject the window can use is read, so the extent of the
+    # correlation (correlation_start and correlation_end) is smaller
+    keys = [k for k in expected if not k.startswith(('correlation_start',
+                                                     'correlation_end'))]
+    assert {k: result.analysis[k] for k in keys} == {k: expected[k] for k in keys}
+
+
+@pytest.mark.parametrize('ratio', [25, 50, 75])
+def test_bits_match_loudness_baseline(pair, ratio):
+    assert_matches_baseline(pair, {'preprocess': f'loudness_{ratio}'},
+                            preprocess=f'loudness_{ratio}_bits')
+
+
+@pytest.mark.parametrize('preprocess', ['rms_200', 'onset_100'])
+def test_envelope_is_near_baseline(pair, preprocess):
+    reference, subject, _ = pair
+    expected, _ = baseline_cross_correlate(reference, subject, SAMPLERATE)
+    factor = align.coarse_factor(SAMPLERATE, preprocess)
+    result = align.cross_correlate(reference, subject, SAMPLERATE,
+                                   preprocess=preprocess)
+    assert abs(result.shift - expected['correlation_shift']) <= 2 * factor
+
+
+@pytest.mark.parametrize('preprocess', ['rms_200', 'onset_100'])
+def test_refined_envelope_matches_baseline(pair, preprocess):
+    assert_matches_baseline(pair, {}, preprocess=preprocess, refine=True)
+
+
+def test_full_correlation_matches_baseline(pair):
+    reference, subject, _ = pair
+    expected, corr = baseline_cross_correlate(reference, subject, SAMPLERATE)
+    result = align.cross_correlate(reference, subject, SAMPLERATE, method='fft',
+                                   correlation='full')
+    assert result.analysis['correlation_shift'] == expected['correlation_shift']
+    assert result.shift_start == expected['correlation_start']
+    np.testing.assert_allclose(result.correlation, corr[:len(result.correlation)],
+                               atol=1e-9)
+
+
+@pytest.mark.parametrize('method', ['fft', 'direct'])
+def test_correlation_curve(pair, method):
+    reference, subject, _ = pair
+    result = align.cross_correlate(reference, subject, SAMPLERATE, method=method,
+                                   correlation='curve', curve_points=100)
+    assert len(result.curve) <= 100
+    assert result.curve.max() == pytest.approx(1)
+    peak = result.curve_shifts()[np.argmax(result.curve)]
+    assert peak <= result.shift < peak + result.curve_step
+
+
+def test_align_many_matches_cross_correlate(pair, tmp_path):
+    reference, subject, _ = pair
+    subjects = [subject, subject[SAMPLERATE:], reference]
+    aligner = align.Aligner(reference, SAMPLERATE, cache=LocalStore(tmp_path))
+    for _ in range(2):  # the second time around, from the cache
+        results = aligner.align_many(subjects)
+        for subj, result in zip(subjects, results):
+            expected, _ = baseline_cross_correlate(reference, subj, SAMPLERATE)
+            assert {k: result.analysis[k] for k in expected} == expected
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.int8, np.uint8])
+def test_histogram_percentile(dtype):
+    info = np.iinfo(dtype)
+    wav = np.random.default_rng(0).integers(info.min, info.max, 10001, dtype=dtype,
+                                            endpoint=True)
+    histogram = align.Histogram(dtype)
+    for i in range(0, len(wav), 4096):
+        histogram.update(wav[i:i + 4096])
+    for q in (0, 1, 25, 50, 99.5, 100):
+        assert histogram.percentile(q) == pytest.approx(np.percentile(wav, q))
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'dtype': 'float32'},
+    {'dtype': 'float32', 'workers': 2},
+    {'workers': -1},
+])
+def test_fft_options_find_the_same_shift(pair, kwargs):
+    reference, subject, _ = pair
+    default = align.cross_correlate(reference, subject, SAMPLERATE)
+    result = align.cross_correlate(reference, subject, SAMPLERATE, **kwargs)
+    assert result.shift == default.shift
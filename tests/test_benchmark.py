@@ -0,0 +1,20 @@
+import pytest
+
+from quarantine_chorus import align
+from quarantine_chorus import benchmark
+
+
+@pytest.mark.parametrize('shift', [0.5, -0.5])
+def test_exact_pair_aligns_with_no_error(shift):
+    reference, subject, expected = benchmark.synthetic_pair(
+        8000, duration=10, shift=shift, exact=True)
+    analysis = align.cross_correlate(reference, subject, 8000).analysis
+    assert analysis['correlation_shift'] == expected
+
+
+def test_run_case_error():
+    result = benchmark.run_case({
+        'preprocess': None, 'samplerate': 8000, 'options': {}, 'duration': 10,
+        'shift_seconds': 0.5, 'seed': 0,
+    })
+    assert abs(result['error']) <= 8
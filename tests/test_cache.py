@@ -0,0 +1,55 @@
+import os
+import time
+
+from quarantine_chorus import cache
+
+
+def set_at(store, key, data, mtime):
+    store.set(key, data)
+    os.utime(store.get_path(key), (mtime, mtime))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    store = cache.LocalStore(tmp_path, max_size=250)
+    now = time.time()
+    set_at(store, 'a', b'a' * 100, now - 30)
+    set_at(store, 'b', b'b' * 100, now - 20)
+    assert store.get('a') == b'a' * 100  # now the most recently used
+    store.set('c', b'c' * 100)
+    assert store.get('b') is None
+    assert store.get('a') == b'a' * 100
+    assert store.get('c') == b'c' * 100
+
+
+def test_evicts_until_under_max_size(tmp_path):
+    store = cache.LocalStore(tmp_path, max_size=150)
+    now = time.time()
+    for i, key in enumerate('abc'):
+        set_at(store, key, b'x' * 50, now - 30 + i)
+    store.set('d', b'x' * 100)
+    assert [f.name for f, _, _ in store.entries()] == ['c', 'd']
+
+
+def test_evicts_by_age(tmp_path):
+    store = cache.LocalStore(tmp_path, max_age=60)
+    now = time.time()
+    set_at(store, 'old', b'old', now - 120)
+    set_at(store, 'new', b'new', now - 30)
+    store.evict()
+    assert store.get('old') is None
+    assert store.get('new') == b'new'
+
+
+def test_no_limits_keeps_everything(tmp_path):
+    store = cache.LocalStore(tmp_path)
+    for key in 'abc':
+        store.set(key, b'x' * 1000)
+    assert len(store.entries()) == 3
+
+
+def test_json_round_trip(tmp_path):
+    store = cache.LocalStore(tmp_path)
+    key = 'alignment-' + cache.hash_params(1, 'ref', samplerate=8000)
+    assert cache.get_json(store, key) is None
+    cache.set_json(store, key, {'correlation_shift': -301})
+    assert cache.get_json(store, key) == {'correlation_shift': -301}
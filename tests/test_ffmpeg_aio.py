@@ -0,0 +1,50 @@
+import threading
+
+import ffmpeg as ffmpeg_python
+import pytest
+
+from quarantine_chorus import ffmpeg
+
+
+def specs(*inputs):
+    return [ffmpeg_python.input(i).output(f'out{n}.wav') for n, i in enumerate(inputs)]
+
+
+def run_in_thread(f):
+    result = {}
+
+    def target():
+        try:
+            result['value'] = f()
+        except BaseException as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def test_run_all(fake_ffmpeg):
+    progress = []
+    results = ffmpeg.run_all(specs('a', 'b', 'c'), max_jobs=2, cmd=fake_ffmpeg,
+                             on_progress=lambda i, p: progress.append((i, p)))
+    assert len(results) == 3
+    assert sorted(i for i, p in progress) == [0, 1, 2]
+    assert all(p.done and p.out_time == 1.0 for i, p in progress)
+
+
+def test_run_all_from_worker_thread(fake_ffmpeg):
+    progress = []
+    results = run_in_thread(lambda: ffmpeg.run_all(
+        specs('a', 'b'), cmd=fake_ffmpeg,
+        on_progress=lambda i, p: progress.append(i)))
+    assert len(results) == 2
+    assert sorted(progress) == [0, 1]
+
+
+def test_run_all_error_from_worker_thread(fake_ffmpeg):
+    with pytest.raises(ffmpeg.Error):
+        run_in_thread(lambda: ffmpeg.run_all(specs('a', 'fail'), cmd=fake_ffmpeg))
@@ -0,0 +1,62 @@
+import json
+
+from quarantine_chorus import ffmpeg
+from quarantine_chorus.ffmpeg.analyze import parse_ebur128_summary, parse_leading_silence
+
+PROBE = ffmpeg.ProbeResult('in.mp4', {
+    'format': {'duration': '30.0'},
+    'streams': [
+        {'codec_type': 'video', 'width': 640, 'height': 360},
+        {'codec_type': 'audio'},
+    ],
+})
+
+
+def ffmpeg_args(fake_ffmpeg):
+    with open(fake_ffmpeg[1].replace('fake_ffmpeg.py', 'args.jsonl')) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_analyze_media(fake_ffmpeg):
+    result = ffmpeg.analyze_media('in.mp4', cmd=fake_ffmpeg, probe=PROBE)
+    [args] = ffmpeg_args(fake_ffmpeg)
+    assert any('ebur128' in arg for arg in args)
+    assert any('cropdetect' in arg for arg in args)
+    assert result['probe'] == PROBE.to_dict()
+
+
+def test_analyze_media_without_audio(fake_ffmpeg):
+    result = ffmpeg.analyze_media('in.mp4', cmd=fake_ffmpeg, probe=PROBE, audio=False)
+    [args] = ffmpeg_args(fake_ffmpeg)
+    assert not any('ebur128' in arg or 'silencedetect' in arg for arg in args)
+    assert any('cropdetect' in arg for arg in args)
+    assert result['loudness'] is None
+    assert result['leading_silence'] == 0.0
+
+
+def test_parse_ebur128_summary():
+    lines = [
+        '[Parsed_ebur128_1 @ 0x5] t: 1.0 TARGET:-23 LUFS M: -20.0 S:-120.7 I: -20.0 LUFS',
+        '[Parsed_ebur128_1 @ 0x5] Summary:',
+        '',
+        '  Integrated loudness:',
+        '    I:         -20.5 LUFS',
+        '    Threshold: -30.8 LUFS',
+        '',
+        '  Loudness range:',
+        '    LRA:         3.2 LU',
+        '',
+        '  True peak:',
+        '    Peak:       -3.1 dBFS',
+    ]
+    assert parse_ebur128_summary(lines) == {'i': -20.5, 'lra': 3.2, 'tp': -3.1}
+
+
+def test_parse_leading_silence():
+    lines = [
+        '[silencedetect @ 0x1] silence_start: 0',
+        '[silencedetect @ 0x1] silence_end: 1.25 | silence_duration: 1.25',
+        '[silencedetect @ 0x1] silence_start: 10',
+    ]
+    assert parse_leading_silence(lines, 30) == 1.25
+    assert parse_leading_silence(lines[2:], 30) == 0.0
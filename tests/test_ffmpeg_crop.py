@@ -0,0 +1,31 @@
+import ffmpeg as ffmpeg_python
+
+# ffmpeg.crop is the crop filter, so import from the module
+from quarantine_chorus.ffmpeg.crop import cropdetect_outputs, parse_cropdetect
+
+
+def seeks(outputs):
+    args = ffmpeg_python.compile(ffmpeg_python.merge_outputs(*outputs))
+    return [float(args[i + 1]) for i, arg in enumerate(args) if arg == '-ss']
+
+
+def test_samples_spread_over_duration():
+    assert seeks(cropdetect_outputs('in.mp4', 50, samples=5)) == [5, 15, 25, 35, 45]
+
+
+def test_no_duration_samples_start():
+    assert seeks(cropdetect_outputs('in.mp4', 0, samples=5)) == [0]
+    assert seeks(cropdetect_outputs('in.mp4', None, samples=5)) == [0]
+
+
+def test_ss_samples_one_point():
+    assert seeks(cropdetect_outputs('in.mp4', 50, ss=20)) == [20]
+
+
+def test_parse_cropdetect():
+    lines = [
+        '[Parsed_cropdetect_0] x1:0 x2:639 y1:40 y2:319 w:640 h:280 x:0 y:40',
+        '[Parsed_cropdetect_0] x1:0 x2:639 y1:0 y2:359 w:640 h:360 x:0 y:0',
+        '[Parsed_cropdetect_0] x1:0 x2:639 y1:40 y2:319 w:640 h:280 x:0 y:40',
+    ]
+    assert parse_cropdetect(lines) == {'x': '0', 'y': '40', 'w': '640', 'h': '280'}
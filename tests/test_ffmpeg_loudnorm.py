@@ -0,0 +1,52 @@
+import pytest
+
+from quarantine_chorus.ffmpeg.loudnorm import parse_analysis
+
+PARAMS = {'i': -16, 'tp': -1.5, 'lra': 11}
+
+ANALYSIS = b'''[Parsed_loudnorm_3 @ 0x1f9b2c00] 
+{
+\t"input_i" : "-21.78",
+\t"input_tp" : "-12.61",
+\t"input_lra" : "0.00",
+\t"input_thresh" : "-31.78",
+\t"output_i" : "-15.99",
+\t"output_tp" : "-6.62",
+\t"output_lra" : "0.10",
+\t"output_thresh" : "-25.99",
+\t"normalization_type" : "dynamic",
+\t"target_offset" : "-0.01"
+}
+'''
+
+# What ffmpeg logs after loudnorm's results, with extract_audio's outputs
+TRAILER = b'''size=     375KiB time=00:00:05.11 bitrate= 601.8kbits/s speed=15.5x    
+[out#0/s16le @ 0x1f9cf6c0] video:0KiB audio:376KiB subtitle:0KiB other streams:0KiB global headers:0KiB muxing overhead: 0.000000%
+[out#1/ipod @ 0x1f999980] video:0KiB audio:124KiB subtitle:0KiB other streams:0KiB global headers:0KiB muxing overhead: 1.818968%
+[out#2/null @ 0x1f9ad140] video:0KiB audio:3004KiB subtitle:0KiB other streams:0KiB global headers:0KiB muxing overhead: unknown
+size=     376KiB time=00:00:08.01 bitrate= 384.0kbits/s speed=24.2x    
+[aac @ 0x1f9ac340] Qavg: 991.101
+'''
+
+# Earlier log output with braces, which isn't loudnorm's
+PREAMBLE = b'''Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'up.mp4':
+  Metadata:
+    comment         : {"not": "loudnorm"}
+'''
+
+
+@pytest.mark.parametrize('stderr', [
+    ANALYSIS,
+    PREAMBLE + ANALYSIS,
+    PREAMBLE + ANALYSIS + TRAILER,
+])
+def test_parse_analysis(stderr):
+    d = parse_analysis(stderr, PARAMS)
+    assert d['input_i'] == '-21.78'
+    assert d['target_offset'] == '-0.01'
+    assert d['i'] == -16
+
+
+def test_parse_analysis_missing():
+    with pytest.raises(ValueError):
+        parse_analysis(PREAMBLE + TRAILER.replace(b'{', b''), PARAMS)
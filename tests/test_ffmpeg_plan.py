@@ -0,0 +1,81 @@
+import pytest
+
+from quarantine_chorus import ffmpeg
+from quarantine_chorus.ffmpeg import plan as encode_plan
+
+CFG = {
+    'samplerate': 48000,
+    'framerate': 30,
+    'resize': {'width': -2, 'height': 360},
+}
+ALIGNED = {'pad_seconds': 0, 'trim_seconds': 0}
+
+
+def probe(width=640, height=360, channels=1):
+    return ffmpeg.ProbeResult('in.mp4', {
+        'format': {'duration': '30.0'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'h264', 'width': width,
+             'height': height, 'r_frame_rate': '30/1', 'avg_frame_rate': '30/1',
+             'pix_fmt': 'yuv420p'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'channels': channels,
+             'sample_rate': '48000'},
+        ],
+    })
+
+
+def test_conforming_upload_is_copied():
+    plan = encode_plan.plan_encode(probe(), ALIGNED, CFG)
+    assert (plan.video, plan.audio) == (encode_plan.COPY, encode_plan.COPY)
+    assert plan.reasons == []
+
+
+def test_full_frame_crop_is_copied():
+    # What cropdetect finds for video with nothing to crop
+    crop = {'w': '640', 'h': '360', 'x': '0', 'y': '0'}
+    plan = encode_plan.plan_encode(probe(), ALIGNED, CFG, crop=crop)
+    assert plan.video == encode_plan.COPY
+    assert plan.crop is None
+    assert 'cropping' not in plan.reasons
+
+
+def test_crop_is_encoded():
+    crop = {'w': '600', 'h': '360', 'x': '20', 'y': '0'}
+    plan = encode_plan.plan_encode(probe(), ALIGNED, CFG, crop=crop)
+    assert plan.video == encode_plan.ENCODE
+    assert plan.crop == {'w': 600, 'h': 360, 'x': 20, 'y': 0}
+    assert 'cropping' in plan.reasons
+
+
+def test_crop_is_resized():
+    crop = {'w': '480', 'h': '270', 'x': '80', 'y': '45'}
+    plan = encode_plan.plan_encode(probe(), ALIGNED, CFG, crop=crop)
+    assert plan.crop == {'w': 480, 'h': 270, 'x': 80, 'y': 45}
+    assert plan.resize == CFG['resize']
+
+
+def test_crop_to_configured_size_is_not_resized():
+    crop = {'w': '640', 'h': '360', 'x': '0', 'y': '60'}
+    plan = encode_plan.plan_encode(probe(640, 480), ALIGNED, CFG, crop=crop)
+    assert plan.crop is not None
+    assert plan.resize is None
+
+
+@pytest.mark.parametrize('analysis, mode', [
+    ({'pad_seconds': 0.02, 'trim_seconds': 0}, encode_plan.SHIFT),
+    ({'pad_seconds': 0, 'trim_seconds': 0.03}, encode_plan.SHIFT),
+    ({'pad_seconds': 1.5, 'trim_seconds': 0}, encode_plan.ENCODE),
+])
+def test_alignment(analysis, mode):
+    plan = encode_plan.plan_encode(probe(), analysis, CFG)
+    assert plan.video == mode
+
+
+def test_noop_filters_are_skipped():
+    plan = encode_plan.plan_encode(probe(channels=2), ALIGNED, CFG)
+    assert plan.video == encode_plan.COPY
+    assert plan.audio == encode_plan.ENCODE
+    assert plan.samplerate is None and plan.resize is None
+    args = encode_plan.output('in.mp4', 'out.mp4', plan, ALIGNED,
+                              ffmpeg.encode.get_profile(CFG)).compile()
+    assert '-filter_complex' not in args
@@ -0,0 +1,34 @@
+import ffmpeg as ffmpeg_python
+
+from quarantine_chorus import ffmpeg
+from quarantine_chorus.ffmpeg import segments
+
+from test_ffmpeg_aio import run_in_thread
+
+
+def test_plan_segments():
+    keyframes = [float(t) for t in range(0, 60, 2)]
+    assert segments.plan_segments(keyframes, 0, 60, 3) == [0, 20.0, 40.0, 60]
+    # Too short to split
+    assert segments.plan_segments(keyframes, 0, 15, 4) == [0, 15]
+
+
+def test_encode_segmented_from_worker_thread(fake_ffmpeg, tmp_path, monkeypatch):
+    commands = []
+    run = ffmpeg.run_all
+
+    def run_all(jobs, **kwargs):
+        commands.extend(ffmpeg_python.compile(job) for job in jobs)
+        return run(jobs, **kwargs)
+
+    monkeypatch.setattr(ffmpeg, 'run_all', run_all)
+    out_file = str(tmp_path / 'out.mp4')
+    run_in_thread(lambda: segments.encode_segmented(
+        'in.mp4', out_file, {'pad_seconds': 0.5, 'trim_seconds': 0},
+        ffmpeg.encode.get_profile(name='fast'), 40.0, segments=2,
+        keyframes=[float(t) for t in range(0, 40, 2)], cmd=fake_ffmpeg))
+    # The audio, then two video segments, the first padded
+    assert len(commands) == 3
+    assert any('audio.m4a' in arg for arg in commands[0])
+    assert any('tpad' in arg for arg in commands[1])
+    assert not any('tpad' in arg for arg in commands[2])
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from quarantine_chorus import loudness
+
+SAMPLERATE = 48000
+
+
+def tone(db, seconds, frequency=1000, channels=2, phase=0.0):
+    """A sine with a peak of `db` dBFS in every channel."""
+    t = np.arange(int(seconds * SAMPLERATE)) / SAMPLERATE
+    x = 10 ** (db / 20) * np.sin(2 * np.pi * frequency * t + phase)
+    return np.stack([x] * channels, axis=1) if channels > 1 else x
+
+
+def measure(audio, channels=2):
+    # Uneven blocks, to cover state carried between blocks
+    return loudness.measure(np.array_split(audio, 7), SAMPLERATE, channels)
+
+
+def test_sine_at_reference_level():
+    # EBU Tech 3341: a stereo 1 kHz sine at -23 dBFS is -23 LUFS
+    meter = measure(tone(-23, 20))
+    assert meter.integrated() == pytest.approx(-23, abs=0.1)
+    assert meter.loudness_range() == pytest.approx(0, abs=0.1)
+    assert meter.true_peak() == pytest.approx(-23, abs=0.1)
+
+
+def test_mono_sine():
+    # One channel has half the power of two
+    meter = measure(tone(-23, 20, channels=1), channels=1)
+    assert meter.integrated() == pytest.approx(-26, abs=0.1)
+
+
+def test_int16_blocks():
+    audio = np.round(tone(-23, 20) * 32768).astype(np.int16)
+    assert measure(audio).integrated() == pytest.approx(-23, abs=0.1)
+
+
+def test_silence():
+    meter = measure(np.zeros((5 * SAMPLERATE, 2)))
+    assert meter.integrated() == loudness.ABSOLUTE_GATE
+    assert meter.loudness_range() == 0.0
+    assert meter.true_peak() == -144.0
+
+
+def test_silence_is_gated():
+    audio = np.concatenate([tone(-23, 10), np.zeros((10 * SAMPLERATE, 2))])
+    assert measure(audio).integrated() == pytest.approx(-23, abs=0.1)
+
+
+def test_relative_gate():
+    # EBU Tech 3341 case 3: quiet parts are below the relative gate
+    audio = np.concatenate([tone(-36, 10), tone(-23, 60), tone(-36, 10)])
+    assert measure(audio).integrated() == pytest.approx(-23, abs=0.1)
+
+
+@pytest.mark.parametrize('first, second, lra', [
+    # EBU Tech 3342 cases 1 and 2
+    (-20, -30, 10),
+    (-20, -15, 5),
+])
+def test_loudness_range(first, second, lra):
+    audio = np.concatenate([tone(first, 20), tone(second, 20)])
+    assert measure(audio).loudness_range() == pytest.approx(lra, abs=1)
+
+
+def test_true_peak_between_samples():
+    # At a quarter of the sample rate and a 45 degree phase, samples miss the peaks
+    # by 3 dB
+    meter = measure(tone(-6, 5, frequency=SAMPLERATE / 4, phase=np.pi / 4))
+    assert 20 * np.log10(meter.sample_peak) == pytest.approx(-9, abs=0.1)
+    assert meter.true_peak() == pytest.approx(-6, abs=0.2)
+
+
+def test_loudnorm_keys():
+    params = {'i': -16, 'tp': -1.5, 'lra': 11}
+    d = measure(tone(-23, 10)).loudnorm(params)
+    assert float(d['input_i']) == pytest.approx(-23, abs=0.1)
+    assert d['normalization_type'] == 'linear'
+    for k in ('input_tp', 'input_lra', 'input_thresh', 'target_offset'):
+        float(d[k])
+
+
+def test_melt_matches_loudness_analysis():
+    melt = pytest.importorskip('quarantine_chorus.mlt.melt')
+    result = measure(tone(-23, 10)).melt(target=-23)
+    # What melt's xml output would have for the same results
+    xml = f'<property name="results">{result["results"]}</property>'
+    parsed = melt.parse_loudness_results(xml, target=-23)
+    assert parsed.keys() == result.keys()
+    for k in ('L', 'R', 'P'):
+        assert parsed[k] == pytest.approx(result[k], abs=1e-6)
+    # Peak is linear, like libebur128's sample peak
+    assert result['P'] == pytest.approx(10 ** (-23 / 20), rel=1e-3)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from quarantine_chorus import align
+from quarantine_chorus import wav
+
+
+@pytest.fixture
+def samples():
+    info = np.iinfo(np.int16)
+    return np.random.default_rng(0).integers(info.min, info.max, 10001,
+                                             dtype=np.int16, endpoint=True)
+
+
+def test_convert_s16_is_a_no_op(samples):
+    assert wav.convert(samples, 's16') is samples
+
+
+@pytest.mark.parametrize('sample_format,zero', [('s8', 0), ('u8', 128)])
+def test_convert_round_trip(samples, sample_format, zero):
+    converted = wav.convert(samples, sample_format, block_size=4096)
+    assert converted.dtype == wav.SAMPLE_FORMATS[sample_format][2]
+    restored = (converted.astype(np.int16) - zero) << 8
+    # Only the low byte is lost
+    np.testing.assert_array_equal(restored, samples & ~0xff)
+
+
+@pytest.mark.parametrize('sample_format', ['s8', 'u8'])
+@pytest.mark.parametrize('q', [25, 50, 99.5])
+def test_converted_percentile(samples, sample_format, q):
+    converted = wav.convert(samples, sample_format)
+    percentile = align.Preprocessor(converted, block_size=4096).percentile(q)
+    assert percentile == pytest.approx(np.percentile(samples >> 8, q))